@@ -1,13 +1,79 @@
+import hashlib
+import json
+import os
+
 import streamlit as st
 import altair as alt
 import pandas as pd
 
+from index_data import WORKBOOK_PATH, workbook_hash, build_dataset, shared_view, memory_report, nearest_countries, with_trend, TREND_TARGET, watch_workbook, view_digest, measure_frame, year_cube, country_frame, dimension_frame
+from spec_cache import spec_version, get_spec, server_transforms_available, warm_up, warm_up_order
+from eu_map import eu_map_feature
+from dashboard import DIMENSION_LABEL, COUNTRY_LABEL
+from timing import configure_logging, start_run, stage, finish_run, fragment_run, stage_rows, spec_rows
+
 #####################################
 #######   Initial Layout   ##########
 #####################################
 
 st.set_page_config(layout="wide")
 
+# rerun records and workbook and spec cache events go to the server log, see DASHBOARD_LOG_LEVEL in timing.py
+configure_logging()
+
+# time the stages of this run, see the debug panel at the bottom
+start_run()
+
+# client side switching, charts carry every country and switch in the browser without a rerun
+# turn on with ?client=1 or CLIENT_SIDE_SWITCHING=1
+client_side_switching = st.query_params.get('client', os.environ.get('CLIENT_SIDE_SWITCHING', '0')) == '1'
+
+# debug panel in the sidebar with the timing of this run, turn on with ?debug=1 or DASHBOARD_DEBUG=1
+debug_panel = st.query_params.get('debug', os.environ.get('DASHBOARD_DEBUG', '0')) == '1'
+
+# server side transforms, Parts 1 and 2 are sent as Vega with the data already transformed by VegaFusion
+# and only the selection driven steps left to the browser, turn on with ?server=1 or SERVER_SIDE_TRANSFORMS=1,
+# without the vegafusion and vl-convert-python packages the charts stay plain Vega-Lite
+server_side_transforms = (st.query_params.get('server', os.environ.get('SERVER_SIDE_TRANSFORMS', '0')) == '1'
+                          and server_transforms_available())
+spec_format = 'vega' if server_side_transforms else 'vega-lite'
+
+# st.vega_lite_chart only takes Vega-Lite, Vega specs are embedded with vega-embed
+VEGA_PAGE = """
+%s
+<div id="vis"></div>
+<script>vegaEmbed('#vis', %s, {actions: false});</script>
+"""
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+
+# the Vega, Vega-Lite and vega-embed versions vl-convert ships, the same ones the specs are compiled with,
+# written once to static/ under a content hashed name like the bundle assets in export.py
+@st.cache_resource(show_spinner=False)
+def vega_script():
+    import vl_convert as vlc
+
+    bundle = vlc.javascript_bundle().encode()
+    name = 'vega-bundle.%s.js' % hashlib.sha256(bundle).hexdigest()[:12]
+    path = os.path.join(STATIC_DIR, name)
+    try:
+        if not os.path.exists(path):
+            tmp = '%s.%d.tmp' % (path, os.getpid())
+            with open(tmp, 'wb') as f:
+                f.write(bundle)
+            os.replace(tmp, path)
+    except OSError:
+        # read-only deployments inline the bundle in every page instead
+        return '<script>%s</script>' % bundle.decode().replace('</', '<\\/')
+    # srcdoc pages resolve relative URLs against the app page, like the map in eu_map.py
+    return '<script src="app/static/%s"></script>' % name
+
+def show_chart(spec, height, width='content'):
+    if spec.get('$schema', '').startswith('https://vega.github.io/schema/vega/'):
+        st.iframe(VEGA_PAGE % (vega_script(), json.dumps(spec).replace('</', '<\\/')), height=height)
+    else:
+        st.vega_lite_chart(spec, width=width)
+
 
 
 
@@ -49,72 +115,129 @@ st.write(" ")
 
 
 # Load Data #
-# Gender Equality Index 
-index_file = pd.ExcelFile('index_file.xlsx')  # Update with the correct file path
-
-# Creating a dictionary to hold dataframes
-dfs = {}
-for sheet_name in index_file.sheet_names:
-    df = pd.read_excel(index_file, sheet_name=sheet_name, usecols=['Index year', 'Gender Equality Index', 'Country'])
-    dfs[sheet_name] = df
-
-# Merging dataframes and renaming columns
-index_all = pd.concat(dfs.values(), axis=0)
-index_all = index_all.rename(columns={'Index year': 'year', 'Gender Equality Index': 'Equality_Index'})
-index_all['year'] = index_all['year'].astype(str)
-
-# Ensure unique_years is defined
-unique_years = sorted(index_all['year'].unique())
-
-# Filtering EU data
-index_eu = index_all[index_all['Country'] == 'EU']
-
-# Assuming the data has been loaded into `index_all` as done previously
-# Make sure to filter for EU only data for the line chart
-index_eu = index_all[index_all['Country'] == 'EU']
-
-# Find the min and max of the Gender Equality Index to set the y-axis domain for the EU data
-min_index = index_eu['Equality_Index'].min()
-max_index = index_eu['Equality_Index'].max()
-
-# Create the selection interval for the EU index chart
-brush = alt.selection_interval(encodings=['x'], name="brush")
-
-# Create the EU index chart with interval selection and dots
-eu_index_chart = alt.Chart(index_eu).mark_line(point=True, color="purple").encode(
-    x='year:O',
-    y=alt.Y('Equality_Index:Q', scale=alt.Scale(domain=(min_index-2, max_index+2))),
-    tooltip=['year', 'Equality_Index']
-).properties(
-    title='EU Gender Equality Index Over Time',
-    width=750,
-    height=550
-).add_selection(brush)
-
-# Create the ranking chart that will show the average index per country with gradient colors
-# The tooltip will display the average index and country
-ranking_chart = alt.Chart(index_all).transform_filter(
-    brush
-).transform_aggregate(
-    average_index='mean(Equality_Index)',
-    groupby=['Country']
-).mark_bar().encode(
-    x=alt.X('average_index:Q', title='Average Gender Equality Index'),
-    y=alt.Y('Country:N', sort=alt.EncodingSortField(field="average_index", order="descending"), title='Country'),
-    color=alt.condition(
-        alt.datum.Country == 'EU',  # If the country is EU
-        alt.value('red'),  # Use the contrasting color for EU
-        alt.Color('average_index:Q', scale=alt.Scale(scheme='purples', domain=[45, 85]))  
-    ),
-    tooltip=['Country:N', 'average_index:Q']
-).properties(
-    width=300,
-    height=560,
-    title='Gender Equality Index Ranking'
-)
-
-# Combine the two charts horizontally
-part1 = alt.hconcat(eu_index_chart, ranking_chart).resolve_scale(color='independent')
+# Gender Equality Index, every sheet of the workbook parsed once into one long table
+# data_version is the workbook content hash, memoized data and charts are keyed on it
+# the table and everything derived from it are shared by all sessions of the process,
+# each rerun only takes views of them
+@st.cache_resource(max_entries=2, show_spinner=False)
+def get_dataset(version):
+    with stage('dataset build'):
+        return build_dataset(WORKBOOK_PATH, digest=version)
+
+# the helpers below read these module globals, the Part 2 and Part 3 fragments load them again on their
+# own reruns so a workbook edited since the last full run shows up there as well
+def load_dataset():
+    global data_version, dataset, index_tidy, digests
+    with stage('workbook load'):
+        data_version = workbook_hash(WORKBOOK_PATH)
+        dataset = get_dataset(data_version)
+        index_tidy = shared_view(dataset['tidy'])
+        # digest of every measure and country, a view is only rebuilt when the rows it shows changed
+        digests = dataset['digests']
+
+load_dataset()
+
+# reparse new or edited sheets in the background as soon as the workbook changes,
+# the next rerun of every session then reads the refreshed cache
+@st.cache_resource(show_spinner=False)
+def start_workbook_watcher(path=WORKBOOK_PATH):
+    return watch_workbook(path)
+
+start_workbook_watcher()
+
+# chart specs are cached per view, keyed on the view's rows and on this script's code
+def chart_version(section, key):
+    return spec_version(view_digest(digests, data_version, section, key), __file__)
+
+# dashed least squares line over a score, its tooltip tells when the line reaches TREND_TARGET
+def trend_layer(chart, x, y='trend', scale=alt.Undefined, title=alt.Undefined, axis=alt.Undefined):
+    return chart.mark_line(color='grey', strokeDash=[4, 4]).encode(
+        x=x,
+        y=alt.Y(y + ':Q', scale=scale, title=title, axis=axis),
+        tooltip=['Country:N', alt.Tooltip(y + ':Q', title='trend'), alt.Tooltip(y + '_target:N', title='reaches %d' % TREND_TARGET)]
+    )
+
+# Part 1 chart, only built when its spec is not cached yet
+def get_part1_chart():
+    # Part 1 frame
+    index_all = measure_frame(index_tidy, 'Gender Equality Index', name='Equality_Index')
+
+    # Ensure unique_years is defined
+    unique_years = sorted(index_all['year'].unique())
+
+    # Filtering EU data
+    index_eu = index_all[index_all['Country'] == 'EU']
+
+    # Assuming the data has been loaded into `index_all` as done previously
+    # Make sure to filter for EU only data for the line chart
+    index_eu = index_all[index_all['Country'] == 'EU']
+    index_eu = with_trend(index_eu, dataset['trends'], 'Gender Equality Index')
+
+    # Find the min and max of the Gender Equality Index to set the y-axis domain for the EU data
+    min_index = index_eu['Equality_Index'].min()
+    max_index = index_eu['Equality_Index'].max()
+
+    # Create the selection interval for the EU index chart
+    brush = alt.selection_interval(encodings=['x'], name="brush")
+
+    # Create the EU index chart with interval selection and dots
+    eu_index_chart = alt.Chart(index_eu).mark_line(point=True, color="purple").encode(
+        x='year:O',
+        y=alt.Y('Equality_Index:Q', scale=alt.Scale(domain=(min_index-2, max_index+2))),
+        tooltip=['year', 'Equality_Index']
+    ).add_selection(brush)
+
+    # linear trend of the EU index
+    eu_trend = trend_layer(alt.Chart(index_eu), 'year:O', scale=alt.Scale(domain=(min_index-2, max_index+2)), title='Equality_Index')
+    eu_index_chart = alt.layer(eu_index_chart, eu_trend).properties(
+        title='EU Gender Equality Index Over Time',
+        width=750,
+        height=550
+    )
+
+    # running sums per country, the brushed years' mean is one subtraction per country in the browser
+    index_cube, cube_years = year_cube(index_all, 'Equality_Index')
+    years_expr = json.dumps(cube_years)
+    last = len(cube_years) - 1
+
+    # position of the first and last brushed year, the whole range while nothing is brushed
+    first_year = "brush.year ? indexof(%s, brush.year[0]) : 0" % years_expr
+    last_year = "brush.year ? indexof(%s, peek(brush.year)) : %d" % (years_expr, last)
+
+    def running(prefix, position):
+        values = '[%s]' % ', '.join('datum.%s_%d' % (prefix, i) for i in range(len(cube_years)))
+        return '(%s >= 0 ? %s[%s] : 0)' % (position, values, position)
+
+    # Create the ranking chart that will show the average index per country with gradient colors
+    # The tooltip will display the average index and country
+    ranking_chart = alt.Chart(index_cube).transform_calculate(
+        lo=first_year,
+        hi=last_year
+    ).transform_calculate(
+        total='%s - %s' % (running('sum', 'datum.hi'), running('sum', 'datum.lo - 1')),
+        count='%s - %s' % (running('count', 'datum.hi'), running('count', 'datum.lo - 1'))
+    ).transform_filter(
+        'datum.count > 0'
+    ).transform_calculate(
+        # rounded so subtracting running sums does not show up as 68.70000000000002
+        average_index='round(datum.total / datum.count * 1e9) / 1e9'
+    ).mark_bar().encode(
+        x=alt.X('average_index:Q', title='Average Gender Equality Index'),
+        y=alt.Y('Country:N', sort=alt.EncodingSortField(field="average_index", order="descending"), title='Country'),
+        color=alt.condition(
+            alt.datum.Country == 'EU',  # If the country is EU
+            alt.value('red'),  # Use the contrasting color for EU
+            alt.Color('average_index:Q', scale=alt.Scale(scheme='purples', domain=[45, 85]))  
+        ),
+        tooltip=['Country:N', 'average_index:Q']
+    ).properties(
+        width=300,
+        height=560,
+        title='Gender Equality Index Ranking'
+    )
+
+    # Combine the two charts horizontally
+    return alt.hconcat(eu_index_chart, ranking_chart).resolve_scale(color='independent')
 
 
 # H2 title
@@ -137,7 +260,9 @@ st.write(" ")
 st.write(" ")
 
 # Display the charts using Streamlit
-st.altair_chart(part1, use_container_width=True)
+part1_spec = get_spec('part1', 'all', chart_version('part1', 'all'), get_part1_chart, spec_format)
+with stage('emit', section='part1', key='all'):
+    show_chart(part1_spec, 680, width='stretch')
 
 #xiugai3
 st.caption('<p style="font-size: 12px; color: grey;">Slide to select an interval on the left and compare the average index of it on the right; Hover on the chart element to read values.The European Union Gender Equality Index rates the EU and its member states on a scale from 1 to 100. The scoring criteria include six dimensions: Work, Money, Knowledge, Time, Power, and Health. Data for the index usually comes from 2-3 years prior to the current year.</p>', unsafe_allow_html=True)
@@ -174,571 +299,200 @@ st.write(" ")
 st.markdown("<span style='font-size:18px;'>Starting from specific dimensions of the Gender Equality Index, we can observe the detailed performance of each EU member from various measurements.</span>", unsafe_allow_html=True)
 st.write(" ")
 
-countryname_mapping = {
-    'BE': 'Belgium',
-    'BG': 'Bulgaria',
-    'CZ': 'Czech Republic',
-    'DK': 'Denmark',
-    'DE': 'Germany',
-    'EE': 'Estonia',
-    'IE': 'Ireland',
-    'EL': 'Greece',
-    'ES': 'Spain',
-    'FR': 'France',
-    'HR': 'Croatia',
-    'IT': 'Italy',
-    'CY': 'Cyprus',
-    'LV': 'Latvia',
-    'LT': 'Lithuania',
-    'LU': 'Luxembourg',
-    'HU': 'Hungary',
-    'MT': 'Malta',
-    'NL': 'Netherlands',
-    'AT': 'Austria',
-    'PL': 'Poland',
-    'PT': 'Portugal',
-    'RO': 'Romania',
-    'SI': 'Slovenia',
-    'SK': 'Slovakia',
-    'FI': 'Finland',
-    'SE': 'Sweden'
-}
 
-# country name dictionary
-country_mapping = {
-    'BE': 56,
-    'BG': 100,
-    'CZ': 203,
-    'DK': 208,
-    'DE': 276,
-    'EE': 233,
-    'IE': 372,
-    'EL': 300,
-    'ES': 724,
-    'FR': 250,
-    'HR': 191,
-    'IT': 380,
-    'CY': 196,
-    'LV': 428,
-    'LT': 440,
-    'LU': 442,
-    'HU': 348,
-    #'MT': 'Malta',
-    'NL': 528,
-    'AT': 40,
-    'PL': 616,
-    'PT': 620,
-    'RO': 642,
-    'SI': 705,
-    'SK': 703,
-    'FI': 246,
-    'SE': 752
+# dimensions offered in the selectbox and the name used in their map title
+dimension_titles = {
+    'WORK': 'Work',
+    'MONEY': 'Money',
+    'KNOWLEDGE': 'Knowledge',
+    'TIME': 'Time',
+    'POWER': 'Power',
+    'HEALTH': 'Health'
 }
 
-# Creating a dictionary to hold dataframes
-dfs = {}
-for sheet_name in index_file.sheet_names:
-    df = pd.read_excel(index_file, sheet_name=sheet_name, usecols=['Index year', 'WORK', 'Country'])
-    dfs[sheet_name] = df
-
-# Merging dataframes and renaming columns
-work_all = pd.concat(dfs.values(), axis=0)
-work_all = work_all.rename(columns={'Index year': 'year', 'WORK': 'WORK'})
-work_all['year'] = work_all['year'].astype(str)
-
-# Ensure unique_years is defined
-unique_years_works = sorted(work_all['year'].unique())
-
-# Filtering EU data
-work_eu = work_all[work_all['Country'] == 'EU']
-
-work_all['id'] = work_all['Country'].map(country_mapping)
-work_all['CountryName'] = work_all['Country'].map(countryname_mapping)
-work_all['rank'] = work_all.groupby(['year'])['WORK'].rank(method='min', ascending=False)
-
-work_min = work_all['WORK'].min()
-work_max = work_all['WORK'].max()
-import pandas as pd
-import altair as alt
-from vega_datasets import data
-
-# introduce map 
-world_map = alt.topo_feature(data.world_110m.url, 'countries')
-
-# create map 
-map_chart_work = alt.Chart(world_map).mark_geoshape(
-    stroke='black'
-).encode(
-    color=alt.Color('WORK:Q', scale=alt.Scale(scheme='purples')),
-    tooltip=['Country:N', 'CountryName:N', 'WORK:Q', 'rank:Q']
-).transform_lookup(
-    lookup='id',
-    from_=alt.LookupData(data=work_all, key='id', fields=['Country', 'CountryName', 'WORK', 'rank'])
-).project(
-    type='mercator',
-    clipExtent= [[300, 0], [800, 600]]
-).properties(width=600, 
-             height=600,
-             title='2023 Work Index across EU Countries'
-)
-
-
-# select country
-select_country = alt.selection_point(fields=['Country'], empty=False, value='EU')
-map_chart_work = map_chart_work.add_params(select_country)
-
-# bar chart
-bar_chart_work = alt.Chart(work_all).mark_bar(color='lavender').encode(
-    x='year:N',
-    y=alt.Y('WORK:Q', title='WORK Index', scale=alt.Scale(domain=[work_min-5, work_max+5], clamp=True)),
-    #color='year:N',
-    tooltip=['Country:N', 'year:N', 'WORK:Q']
-).transform_filter(
-    select_country
-)
-
-# line chart
-line_chart_work = alt.Chart(work_all).mark_line(point=True, color='purple').encode(
-    x='year:N',
-    y=alt.Y('rank:Q', axis=alt.Axis(title='Country Rank'), scale=alt.Scale(domain=[30, 0])),
-    #color='year:N',
-    tooltip=['Country:N', 'year:N', 'rank:Q']
-).transform_filter(
-    select_country
-)
-
-country_chart_work = (bar_chart_work + line_chart_work).resolve_scale(
-    y='independent'  
-).properties(
-    width=400,
-    height=300,
-    title = 'Index and Ranking of Selected Country over Time'
-)
-
-# combine work chart
-part2_work = alt.hconcat(map_chart_work, country_chart_work) 
-
-# set properties
-part2_work = part2_work.properties(
-    config=alt.Config(legend=alt.LegendConfig(orient='left'))
-)
-
-
-## MONEY
-
-
-# Creating a dictionary to hold dataframes
-dfs = {}
-for sheet_name in index_file.sheet_names:
-    df = pd.read_excel(index_file, sheet_name=sheet_name, usecols=['Index year', 'MONEY', 'Country'])
-    dfs[sheet_name] = df
-
-# Merging dataframes and renaming columns
-money_all = pd.concat(dfs.values(), axis=0)
-money_all = money_all.rename(columns={'Index year': 'year', 'MONEY': 'MONEY'})
-money_all['year'] = money_all['year'].astype(str)
-
-# Ensure unique_years is defined
-unique_years_money = sorted(money_all['year'].unique())
-
-# Filtering EU data
-money_eu = money_all[money_all['Country'] == 'EU']
-
-money_all['id'] = money_all['Country'].map(country_mapping)
-money_all['CountryName'] = money_all['Country'].map(countryname_mapping)
-money_all['rank'] = money_all.groupby(['year'])['MONEY'].rank(method='min', ascending=False)
-
-money_min = money_all['MONEY'].min()
-money_max = money_all['MONEY'].max()
-import pandas as pd
-import altair as alt
-from vega_datasets import data
-
-# introduce map 
-world_map = alt.topo_feature(data.world_110m.url, 'countries')
-
-# create map
-map_chart_money = alt.Chart(world_map).mark_geoshape(
-    stroke='black'
-).encode(
-    color=alt.Color('MONEY:Q', scale=alt.Scale(scheme='purples')),
-    tooltip=['Country:N', 'CountryName:N', 'MONEY:Q', 'rank:Q']
-).transform_lookup(
-    lookup='id',
-    from_=alt.LookupData(data=money_all, key='id', fields=['Country', 'CountryName', 'MONEY', 'rank'])
-).project(
-    type='mercator',
-    clipExtent= [[300, 0], [800, 600]]
-).properties(width=600, 
-             height=600,
-             title='2023 Money Index across EU Countries'
-)
-
-# select country
-select_country = alt.selection_point(fields=['Country'], empty=False, value='EU')
-map_chart_money = map_chart_money.add_params(select_country)
-
-# bar chart
-bar_chart_money = alt.Chart(money_all).mark_bar(color='lavender').encode(
-    x='year:N',
-    y=alt.Y('MONEY:Q', title='MONEY Index', scale=alt.Scale(domain=[money_min-5, money_max+5], clamp=True)),
-    tooltip=['Country:N', 'year:N', 'MONEY:Q']
-).transform_filter(
-    select_country
-)
-
-# line chart 
-line_chart_money = alt.Chart(money_all).mark_line(point=True, color='purple').encode(
-    x='year:N',
-    y=alt.Y('rank:Q', axis=alt.Axis(title='Country Rank'), scale=alt.Scale(domain=[30, 0])),
-    #color='year:N',
-    tooltip=['Country:N', 'year:N', 'rank:Q']
-).transform_filter(
-    select_country
-)
-
-country_chart_money = (bar_chart_money + line_chart_money).resolve_scale(
-    y='independent'  
-).properties(
-    width=400,
-    height=300,
-    title = 'Index and Ranking of Selected Country over Time'
-)
-
-# combine money chart 
-part2_money = alt.hconcat(map_chart_money, country_chart_money).properties(
-    config=alt.Config(legend=alt.LegendConfig(orient='left'))
-)
-
-
-## KNOWLEDGE
-
-# Creating a dictionary to hold dataframes
-dfs = {}
-for sheet_name in index_file.sheet_names:
-    df = pd.read_excel(index_file, sheet_name=sheet_name, usecols=['Index year', 'KNOWLEDGE', 'Country'])
-    dfs[sheet_name] = df
-
-# Merging dataframes and renaming columns
-knowledge_all = pd.concat(dfs.values(), axis=0)
-knowledge_all = knowledge_all.rename(columns={'Index year': 'year', 'KNOWLEDGE': 'KNOWLEDGE'})
-knowledge_all['year'] = knowledge_all['year'].astype(str)
-
-# Ensure unique_years is defined
-unique_years_knowledge = sorted(knowledge_all['year'].unique())
-
-# Filtering EU data
-knowledge_eu = knowledge_all[knowledge_all['Country'] == 'EU']
-
-knowledge_all['id'] = knowledge_all['Country'].map(country_mapping)
-knowledge_all['CountryName'] = knowledge_all['Country'].map(countryname_mapping)
-knowledge_all['rank'] = knowledge_all.groupby(['year'])['KNOWLEDGE'].rank(method='min', ascending=False)
-
-knowledge_min = knowledge_all['KNOWLEDGE'].min()
-knowledge_max = knowledge_all['KNOWLEDGE'].max()
-import pandas as pd
-import altair as alt
-from vega_datasets import data
-
-# introduce map 
-world_map = alt.topo_feature(data.world_110m.url, 'countries')
-
-# create map 
-map_chart_knowledge = alt.Chart(world_map).mark_geoshape(
-    stroke='black'
-).encode(
-    color=alt.Color('KNOWLEDGE:Q', scale=alt.Scale(scheme='purples')),
-    tooltip=['Country:N', 'CountryName:N', 'KNOWLEDGE:Q', 'rank:Q']
-).transform_lookup(
-    lookup='id',
-    from_=alt.LookupData(data=knowledge_all, key='id', fields=['Country', 'CountryName', 'KNOWLEDGE', 'rank'])
-).project(
-    type='mercator',
-    clipExtent= [[300, 0], [800, 600]]
-).properties(width=600, 
-             height=600,
-             title='2023 Knowledge Index across EU Countries'
-)
-
-# select country
-select_country = alt.selection_point(fields=['Country'], empty=False, value='EU')
-map_chart_knowledge = map_chart_knowledge.add_params(select_country)
-
-# bar chart 
-bar_chart_knowledge = alt.Chart(knowledge_all).mark_bar(color='lavender').encode(
-    x='year:N',
-    y=alt.Y('KNOWLEDGE:Q', title='KNOWLEDGE Index', scale=alt.Scale(domain=[knowledge_min-5, knowledge_max+5], clamp=True)),
-    tooltip=['Country:N', 'year:N', 'KNOWLEDGE:Q']
-).transform_filter(
-    select_country
-)
-
-# line chart
-line_chart_knowledge = alt.Chart(knowledge_all).mark_line(point=True, color='purple').encode(
-    x='year:N',
-    y=alt.Y('rank:Q', axis=alt.Axis(title='Country Rank'), scale=alt.Scale(domain=[30, 0])),
-    #color='year:N',
-    tooltip=['Country:N', 'year:N', 'rank:Q']
-).transform_filter(
-    select_country
-)
-
-country_chart_knowledge = (bar_chart_knowledge + line_chart_knowledge).resolve_scale(
-    y='independent'  
-).properties(
-    width=400,
-    height=300,
-    title = 'Index and Ranking of Selected Country over Time'
-)
-
-# combine knowledge chart 
-part2_knowledge = alt.hconcat(map_chart_knowledge, country_chart_knowledge).properties(
-    config=alt.Config(legend=alt.LegendConfig(orient='left'))
-)
-
-
-## TIME
-# Creating a dictionary to hold dataframes
-dfs = {}
-for sheet_name in index_file.sheet_names:
-    df = pd.read_excel(index_file, sheet_name=sheet_name, usecols=['Index year', 'TIME', 'Country'])
-    dfs[sheet_name] = df
-
-# Merging dataframes and renaming columns
-time_all = pd.concat(dfs.values(), axis=0)
-time_all = time_all.rename(columns={'Index year': 'year', 'TIME': 'TIME'})
-time_all['year'] = time_all['year'].astype(str)
-
-# Filtering EU data
-time_eu = time_all[time_all['Country'] == 'EU']
-
-time_all['id'] = time_all['Country'].map(country_mapping)
-time_all['CountryName'] = time_all['Country'].map(countryname_mapping)
-time_all['rank'] = time_all.groupby(['year'])['TIME'].rank(method='min', ascending=False)
-
-time_min = time_all['TIME'].min()
-time_max = time_all['TIME'].max()
-import pandas as pd
-import altair as alt
-from vega_datasets import data
-
-# introduce map 
-world_map = alt.topo_feature(data.world_110m.url, 'countries')
-
-# create map
-map_chart_time = alt.Chart(world_map).mark_geoshape(
-    stroke='black'
-).encode(
-    color=alt.Color('TIME:Q', scale=alt.Scale(scheme='purples')),
-    tooltip=['Country:N', 'CountryName:N', 'TIME:Q', 'rank:Q']
-).transform_lookup(
-    lookup='id',
-    from_=alt.LookupData(data=time_all, key='id', fields=['Country', 'CountryName', 'TIME', 'rank'])
-).project(
-    type='mercator',
-    clipExtent= [[300, 0], [800, 600]]
-).properties(width=600, 
-             height=600,
-             title='2023 Time Index across EU Countries'
-)
-
-# select country
-select_country = alt.selection_point(fields=['Country'], empty=False, value='EU')
-map_chart_time = map_chart_time.add_params(select_country)
-
-# bar chart 
-bar_chart_time = alt.Chart(time_all).mark_bar(color='lavender').encode(
-    x='year:N',
-    y=alt.Y('TIME:Q', title='TIME Index', scale=alt.Scale(domain=[time_min-5,time_max+5], clamp=True)),
-    tooltip=['Country:N', 'year:N', 'TIME:Q']
-).transform_filter(
-    select_country
-)
-
-# line chart 
-line_chart_time = alt.Chart(time_all).mark_line(point=True, color='purple').encode(
-    x='year:N',
-    y=alt.Y('rank:Q', axis=alt.Axis(title='Country Rank'), scale=alt.Scale(domain=[30, 0])),
-    #color='year:N',
-    tooltip=['Country:N', 'year:N', 'rank:Q']
-).transform_filter(
-    select_country
-)
-
-country_chart_time = (bar_chart_time + line_chart_time).resolve_scale(
-    y='independent'  
-).properties(
-    width=400,
-    height=300,
-    title = 'Index and Ranking of Selected Country over Time'
-)
-
-# combine time chart
-part2_time = alt.hconcat(map_chart_time, country_chart_time).properties(
-    config=alt.Config(legend=alt.LegendConfig(orient='left'))
-)
-
-## POWER
-# Creating a dictionary to hold dataframes
-dfs = {}
-for sheet_name in index_file.sheet_names:
-    df = pd.read_excel(index_file, sheet_name=sheet_name, usecols=['Index year', 'POWER', 'Country'])
-    dfs[sheet_name] = df
-
-# Merging dataframes and renaming columns
-power_all = pd.concat(dfs.values(), axis=0)
-power_all = power_all.rename(columns={'Index year': 'year', 'POWER': 'POWER'})
-power_all['year'] = power_all['year'].astype(str)
-
-# Filtering EU data
-power_eu = power_all[power_all['Country'] == 'EU']
-
-power_all['id'] = power_all['Country'].map(country_mapping)
-power_all['CountryName'] = power_all['Country'].map(countryname_mapping)
-power_all['rank'] = power_all.groupby(['year'])['POWER'].rank(method='min', ascending=False)
-
-power_min = power_all['POWER'].min()
-power_max = power_all['POWER'].max()
-import pandas as pd
-import altair as alt
-from vega_datasets import data
-
-# introduce map 
-world_map = alt.topo_feature(data.world_110m.url, 'countries')
-
-# create map 
-map_chart_power = alt.Chart(world_map).mark_geoshape(
-    stroke='black'
-).encode(
-    color=alt.Color('POWER:Q', scale=alt.Scale(scheme='purples')),
-    tooltip=['Country:N', 'CountryName:N', 'POWER:Q', 'rank:Q']
-).transform_lookup(
-    lookup='id',
-    from_=alt.LookupData(data=power_all, key='id', fields=['Country', 'CountryName', 'POWER', 'rank'])
-).project(
-    type='mercator',
-    clipExtent= [[300, 0], [800, 600]]
-).properties(width=600, 
-             height=600,
-             title='2023 Power Index across EU Countries'
-)
-
-# select country 
-select_country = alt.selection_point(fields=['Country'], empty=False, value='EU')
-map_chart_power = map_chart_power.add_params(select_country)
-
-# bar chart 
-bar_chart_power = alt.Chart(power_all).mark_bar(color='lavender').encode(
-    x='year:N',
-    y=alt.Y('POWER:Q', title='POWER Index', scale=alt.Scale(domain=[power_min-5,power_max+5], clamp=True)),
-    tooltip=['Country:N', 'year:N', 'POWER:Q']
-).transform_filter(
-    select_country
-)
-
-# line chart
-line_chart_power = alt.Chart(power_all).mark_line(point=True, color='purple').encode(
-    x='year:N',
-    y=alt.Y('rank:Q', axis=alt.Axis(title='Country Rank'), scale=alt.Scale(domain=[30, 0])),
-    #color='year:N',
-    tooltip=['Country:N', 'year:N', 'rank:Q']
-).transform_filter(
-    select_country
-)
-
-country_chart_power = (bar_chart_power + line_chart_power).resolve_scale(
-    y='independent'  
-).properties(
-    width=400,
-    height=300,
-    title = 'Index and Ranking of Selected Country over Time'
-)
-
-# combine power chart 
-part2_power = alt.hconcat(map_chart_power, country_chart_power).properties(
-    config=alt.Config(legend=alt.LegendConfig(orient='left'))
-)
-
-## HEALTH
-# Creating a dictionary to hold dataframes
-dfs = {}
-for sheet_name in index_file.sheet_names:
-    df = pd.read_excel(index_file, sheet_name=sheet_name, usecols=['Index year', 'HEALTH', 'Country'])
-    dfs[sheet_name] = df
-
-# Merging dataframes and renaming columns
-health_all = pd.concat(dfs.values(), axis=0)
-health_all = health_all.rename(columns={'Index year': 'year', 'HEALTH': 'HEALTH'})
-health_all['year'] = health_all['year'].astype(str)
-
-# Filtering EU data
-health_eu = health_all[health_all['Country'] == 'EU']
-
-health_all['id'] = health_all['Country'].map(country_mapping)
-health_all['CountryName'] = health_all['Country'].map(countryname_mapping)
-health_all['rank'] = health_all.groupby(['year'])['HEALTH'].rank(method='min', ascending=False)
-
-health_min = health_all['HEALTH'].min()
-health_max = health_all['HEALTH'].max()
-import pandas as pd
-import altair as alt
-from vega_datasets import data
-
-# introduce map 
-world_map = alt.topo_feature(data.world_110m.url, 'countries')
-
-# create map 
-map_chart_health = alt.Chart(world_map).mark_geoshape(
-    stroke='black'
-).encode(
-    color=alt.Color('HEALTH:Q', scale=alt.Scale(scheme='purples')),
-    tooltip=['Country:N', 'CountryName:N', 'HEALTH:Q', 'rank:Q']
-).transform_lookup(
-    lookup='id',
-    from_=alt.LookupData(data=health_all, key='id', fields=['Country', 'CountryName', 'HEALTH', 'rank'])
-).project(
-    type='mercator',
-    clipExtent= [[300, 0], [800, 600]]
-).properties(width=600, 
-             height=600,
-             title='2023 Health Index across EU Countries'
-)
-
-# select country 
-select_country = alt.selection_point(fields=['Country'], empty=False, value='EU')
-map_chart_health = map_chart_health.add_params(select_country)
-
-# bar chart 
-bar_chart_health = alt.Chart(health_all).mark_bar(color='lavender').encode(
-    x='year:N',
-    y=alt.Y('HEALTH:Q', title='HEALTH Index', scale=alt.Scale(domain=[health_min-5,health_max+5], clamp=True)),
-    tooltip=['Country:N', 'year:N', 'HEALTH:Q']
-).transform_filter(
-    select_country
-)
-
-# line chart
-line_chart_health = alt.Chart(health_all).mark_line(point=True, color='purple').encode(
-    x='year:N',
-    y=alt.Y('rank:Q', axis=alt.Axis(title='Country Rank'), scale=alt.Scale(domain=[30, 0])),
-    #color='year:N',
-    tooltip=['Country:N', 'year:N', 'rank:Q']
-).transform_filter(
-    select_country
-)
-
-country_chart_health = (bar_chart_health + line_chart_health).resolve_scale(
-    y='independent'  
-).properties(
-    width=400,
-    height=300,
-    title = 'Index and Ranking of Selected Country over Time'
-)
-
-# concat
-part2_health = alt.hconcat(map_chart_health, country_chart_health).properties(
-    config=alt.Config(legend=alt.LegendConfig(orient='left'))
-)
+# introduce map, EU members only, served by the app itself
+eu_map = eu_map_feature()
+
+# domain of every dimension, computed with the ranks once per workbook
+def get_dimension_bounds():
+    return shared_view(dataset['dimension_bounds'])
+
+# frame of one dimension with map id, country name and yearly rank
+def get_dimension_data(dimension):
+    table = shared_view(dataset['dimension_table'])
+    with stage('frame', section='part2', key=dimension):
+        return dimension_frame(table, dimension)
+
+# map, bar and line chart of one dimension, only built once the dimension is selected
+def get_dimension_chart(dimension):
+    dimension_all = with_trend(get_dimension_data(dimension), dataset['trends'], dimension)
+    bounds = get_dimension_bounds()
+    dimension_min = bounds.loc[dimension, 'min']
+    dimension_max = bounds.loc[dimension, 'max']
+
+    # create map 
+    map_chart = alt.Chart(eu_map).mark_geoshape(
+        stroke='black'
+    ).encode(
+        color=alt.Color(dimension + ':Q', scale=alt.Scale(scheme='purples')),
+        tooltip=['Country:N', 'CountryName:N', dimension + ':Q', 'rank:Q']
+    ).transform_lookup(
+        lookup='id',
+        from_=alt.LookupData(data=dimension_all, key='id', fields=['Country', 'CountryName', dimension, 'rank'])
+    ).project(
+        type='mercator'
+    ).properties(width=600, 
+                 height=600,
+                 title='2023 %s Index across EU Countries' % dimension_titles[dimension]
+    )
+
+    # select country
+    select_country = alt.selection_point(fields=['Country'], empty=False, value='EU')
+    map_chart = map_chart.add_params(select_country)
+
+    # bar chart
+    bar_chart = alt.Chart(dimension_all).mark_bar(color='lavender').encode(
+        x='year:N',
+        y=alt.Y(dimension + ':Q', title=dimension + ' Index', scale=alt.Scale(domain=[dimension_min-5, dimension_max+5], clamp=True)),
+        tooltip=['Country:N', 'year:N', dimension + ':Q']
+    ).transform_filter(
+        select_country
+    )
+
+    # linear trend of the selected country, on a scale of its own equal to the bar scale
+    trend_chart = trend_layer(alt.Chart(dimension_all), 'year:N',
+                              scale=alt.Scale(domain=[dimension_min-5, dimension_max+5], clamp=True),
+                              axis=None).transform_filter(
+        select_country
+    )
+
+    # line chart
+    line_chart = alt.Chart(dimension_all).mark_line(point=True, color='purple').encode(
+        x='year:N',
+        y=alt.Y('rank:Q', axis=alt.Axis(title='Country Rank'), scale=alt.Scale(domain=[30, 0])),
+        tooltip=['Country:N', 'year:N', 'rank:Q']
+    ).transform_filter(
+        select_country
+    )
+
+    country_chart = (bar_chart + line_chart + trend_chart).resolve_scale(
+        y='independent'  
+    ).properties(
+        width=400,
+        height=300,
+        title = 'Index and Ranking of Selected Country over Time'
+    )
+
+    # combine dimension chart
+    return alt.hconcat(map_chart, country_chart).properties(
+        config=alt.Config(legend=alt.LegendConfig(orient='left'))
+    )
+
+# every dimension in one row per country and year, sent once in client side mode
+def get_dimension_wide():
+    wide = shared_view(dataset['dimension_wide'])
+    for dimension in dimension_titles:
+        wide = with_trend(wide, dataset['trends'], dimension, name='trend_' + dimension)
+    return wide
+
+# map, bar and line chart for all dimensions, the dimension is picked by a dropdown inside the chart
+def get_all_dimensions_chart(default_dimension):
+    all_dimensions = get_dimension_wide()
+    bounds = get_dimension_bounds()
+    dimensions = list(dimension_titles)
+
+    dimension_param = alt.param(
+        name='dimension',
+        value=default_dimension,
+        bind=alt.binding_select(options=dimensions, name=DIMENSION_LABEL + ' ')
+    )
+
+    # per dimension constants as expressions of the selected dimension
+    def pick(values):
+        expr = repr(values[dimensions[-1]])
+        for dimension in reversed(dimensions[:-1]):
+            expr = "dimension === '%s' ? %r : %s" % (dimension, values[dimension], expr)
+        return alt.ExprRef(expr)
+
+    # a column per dimension, named in full so the dataset keeps it
+    def pick_column(template):
+        expr = 'datum.' + template % dimensions[-1]
+        for dimension in reversed(dimensions[:-1]):
+            expr = "dimension === '%s' ? datum.%s : %s" % (dimension, template % dimension, expr)
+        return expr
+
+    # score, rank and trend of the selected dimension
+    selected = {'Index': 'datum[dimension]', 'rank': "datum['rank_' + dimension]",
+                'trend': pick_column('trend_%s'), 'trend_target': pick_column('trend_%s_target')}
+
+    # create map 
+    map_chart = alt.Chart(eu_map).mark_geoshape(
+        stroke='black'
+    ).encode(
+        color=alt.Color('Index:Q', scale=alt.Scale(scheme='purples')),
+        tooltip=['Country:N', 'CountryName:N', 'Index:Q', 'rank:Q']
+    ).transform_lookup(
+        lookup='id',
+        from_=alt.LookupData(data=all_dimensions, key='id', fields=['Country', 'CountryName'] + dimensions + ['rank_' + d for d in dimensions])
+    ).transform_calculate(
+        **selected
+    ).project(
+        type='mercator'
+    ).properties(width=600, 
+                 height=600,
+                 title=alt.Title(text=pick({d: '2023 %s Index across EU Countries' % dimension_titles[d] for d in dimensions}))
+    )
+
+    # select country, kept across dimension switches as it only depends on the country
+    select_country = alt.selection_point(fields=['Country'], empty=False, value='EU')
+    map_chart = map_chart.add_params(select_country)
+
+    # bar chart
+    index_scale = alt.Scale(
+        domainMin=pick({d: float(bounds.loc[d, 'min']) - 5 for d in dimensions}),
+        domainMax=pick({d: float(bounds.loc[d, 'max']) + 5 for d in dimensions}),
+        clamp=True
+    )
+    bar_chart = alt.Chart(all_dimensions).transform_filter(
+        select_country
+    ).transform_calculate(
+        **selected
+    ).mark_bar(color='lavender').encode(
+        x='year:N',
+        y=alt.Y('Index:Q', title='Index', scale=index_scale),
+        tooltip=['Country:N', 'year:N', 'Index:Q']
+    )
+
+    # linear trend of the selected country, on a scale of its own equal to the bar scale
+    trend_chart = trend_layer(alt.Chart(all_dimensions).transform_filter(
+        select_country
+    ).transform_calculate(
+        **selected
+    ), 'year:N', scale=index_scale, axis=None)
+
+    # line chart
+    line_chart = alt.Chart(all_dimensions).transform_filter(
+        select_country
+    ).transform_calculate(
+        **selected
+    ).mark_line(point=True, color='purple').encode(
+        x='year:N',
+        y=alt.Y('rank:Q', axis=alt.Axis(title='Country Rank'), scale=alt.Scale(domain=[30, 0])),
+        tooltip=['Country:N', 'year:N', 'rank:Q']
+    )
+
+    country_chart = (bar_chart + line_chart + trend_chart).resolve_scale(
+        y='independent'  
+    ).properties(
+        width=400,
+        height=300,
+        title = 'Index and Ranking of Selected Country over Time'
+    )
+
+    # combine dimension chart
+    return alt.hconcat(map_chart, country_chart).add_params(dimension_param).properties(
+        config=alt.Config(legend=alt.LegendConfig(orient='left'))
+    )
 
 
 # dropdown
@@ -747,33 +501,37 @@ part2_health = alt.hconcat(map_chart_health, country_chart_health).properties(
 #xiugai4
 # css
 
-# show selectbox
-option = st.selectbox(
-    'Choose A Dimension to Dive in:',
-    ['WORK', 'MONEY', 'KNOWLEDGE', 'TIME', 'POWER', 'HEALTH']
-)
+# display function, builds the selected dimension on first use
+def display_chart(dimension):
+    part2_spec = get_spec('part2', dimension, chart_version('part2', dimension), lambda: get_dimension_chart(dimension), spec_format)
+    with stage('emit', section='part2', key=dimension):
+        show_chart(part2_spec, 720, width='stretch')
 
-#xiugai6
-st.caption('<p style="font-size: 12px; color: grey;">Click to select a country on the left and observe its detailed evolution of index on a specified dimension on the right, bar chart for index and line chart for ranking.</p>', unsafe_allow_html=True)
+# selectbox and chart, a new dimension reruns only this section
+@st.fragment
+def dimension_section():
+    with fragment_run('part2'):
+        load_dataset()
 
+        # show selectbox, in client side mode the dropdown is part of the chart
+        if not client_side_switching:
+            option = st.selectbox(
+                DIMENSION_LABEL,
+                list(dimension_titles)
+            )
 
-# display function
-def display_chart(dimension):
-    if dimension == 'WORK':
-        st.altair_chart(part2_work, use_container_width=True)
-    elif dimension == 'MONEY':
-        st.altair_chart(part2_money, use_container_width=True)
-    elif dimension == 'KNOWLEDGE':
-        st.altair_chart(part2_knowledge, use_container_width=True)
-    elif dimension == 'TIME':
-        st.altair_chart(part2_time, use_container_width=True)
-    elif dimension == 'POWER':
-        st.altair_chart(part2_power, use_container_width=True)
-    elif dimension == 'HEALTH':
-        st.altair_chart(part2_health, use_container_width=True)
-
-# display
-display_chart(option)
+        #xiugai6
+        st.caption('<p style="font-size: 12px; color: grey;">Click to select a country on the left and observe its detailed evolution of index on a specified dimension on the right, bar chart for index and line chart for ranking.</p>', unsafe_allow_html=True)
+
+        # display
+        if client_side_switching:
+            all_dimensions_spec = get_spec('part2', 'all', chart_version('part2', 'all'), lambda: get_all_dimensions_chart('WORK'), spec_format)
+            with stage('emit', section='part2', key='all'):
+                show_chart(all_dimensions_spec, 760, width='stretch')
+        else:
+            display_chart(option)
+
+dimension_section()
 
 
 #####################################
@@ -813,93 +571,174 @@ category_mapping = {
 }
 name = ['WORK', 'MONEY', 'KNOWLEDGE', 'TIME', 'POWER', 'HEALTH']
 
-# data
-def get_data(country_name, category):
-    df_list = []
-    for i, sheet_name in enumerate(index_file.sheet_names):
-        df = pd.read_excel(index_file, sheet_name=sheet_name)
-        df['Time'] = sheet_name[:4]
-        category_names = category_mapping[category]
-        df = df[df['Country'] == country_name]
-        df = df[['Time', 'Country'] + list(category_names)] 
-        df_list.append(df)  
-    return pd.concat(df_list)
+# memo bounds for Part 3, every country and category fits, idle entries expire after an hour
+PART3_CACHE_ENTRIES = 27 * 6
+PART3_CACHE_TTL = 60 * 60
+
+custom_color = {  
+    'WORK':'red',
+    'MONEY':'red',
+    'KNOWLEDGE':'red',
+    'TIME':'red',
+    'POWER':'red',
+    'HEALTH':'red',
+    'Participation':'purple', 
+    'Segregation and quality of work': 'purple',
+    'Financial resources':'purple', 
+    'Economic situation':'purple',
+    'Attainment and participation':'purple',
+    'Segregation':'purple',
+    'Care activities':'purple', 
+    'Social activities':'purple',
+    'Political':'purple', 
+    'Economic':'purple', 
+    'Social':'purple', 
+    'Status':'purple', 
+    'Behaviour':'purple', 
+    'Access':'purple'
+}
+
+# data, memoized per (country, category, version of the country's rows)
+@st.cache_data(max_entries=PART3_CACHE_ENTRIES, ttl=PART3_CACHE_TTL, show_spinner=False)
+def get_data(country_name, category, version=data_version):
+    category_names = category_mapping[category]
+    with stage('frame', section='part3', key='%s/%s' % (country_name, name[category - 1])):
+        return country_frame(index_tidy, country_name, list(category_names))
+
+# line and points of one category
+def category_layer(base, category, trend_base, trend='trend'):
+    line = base.mark_line().encode(
+        x='Time:O',
+        y=alt.Y('Index:Q', title='Index', scale=alt.Scale(domain=(50, 100))),
+        color=alt.Color('Category:N', scale=alt.Scale(domain=list(custom_color.keys()), range=list(custom_color.values()))),
+        tooltip=['Country:N', 'Index:Q', 'Category:N']
+    )
+
+    points = base.mark_point().encode(
+        x='Time:O',
+        y=alt.Y('Index:Q', title='Index', scale=alt.Scale(domain=(50, 100))),
+        color=alt.Color('Category:N', scale=alt.Scale(domain=list(custom_color.keys()), range=list(custom_color.values()))),
+        tooltip=['Country:N', 'Index:Q', 'Category:N']
+    )
+
+    # linear trend of the dimension
+    dimension_trend = trend_layer(trend_base, 'Time:O', trend, scale=alt.Scale(domain=(50, 100)), title='Index')
+
+    # create chart
+    return alt.layer(line, points, dimension_trend).properties(
+        title=name[category - 1],
+        height=200,
+        width=300  
+    ).interactive()
+
+# chart of one category, memoized with the same key so a revisited country is a lookup
+@st.cache_resource(max_entries=PART3_CACHE_ENTRIES, ttl=PART3_CACHE_TTL, show_spinner=False)
+def get_category_chart(country_name, category, version=data_version):
+    data = get_data(country_name, category, version)
+    trend = with_trend(data[['Time', 'Country']], dataset['trends'], name[category - 1], year='Time')
+    data = data.melt(id_vars=['Time', 'Country'], var_name='Category', value_name='Index')
+    return category_layer(alt.Chart(data), category, alt.Chart(trend))
 
 # dropdown options 
-country_dropdown = st.selectbox('Choose Country:', ['BE', 'BG', 'CZ', 'DK', 'DE', 'EE', 'IE', 'EL', 'ES', 'FR',
-                                                    'HR', 'IT', 'CY', 'LV', 'LT', 'LU', 'HU', 'MT', 'NL',
-                                                    'AT', 'PL', 'PT', 'RO', 'SI', 'SK', 'FI', 'SE'], index=9)
+country_options = ['BE', 'BG', 'CZ', 'DK', 'DE', 'EE', 'IE', 'EL', 'ES', 'FR',
+                   'HR', 'IT', 'CY', 'LV', 'LT', 'LU', 'HU', 'MT', 'NL',
+                   'AT', 'PL', 'PT', 'RO', 'SI', 'SK', 'FI', 'SE']
+
+
+# all six category charts of one country
+def get_country_chart(country_name):
+    charts = {}
+    # for each dimensions
+    for i in range(1, 7):
+        charts[i] = get_category_chart(country_name, i, view_digest(digests, data_version, 'part3', country_name))
 
+    first_row = alt.hconcat(charts[1], charts[2], charts[3])
+    second_row = alt.hconcat(charts[4], charts[5], charts[6])
 
-charts = {}
+    return alt.vconcat(first_row, second_row)
 
 # change country function
 def on_country_change(country_name):
-    country_category_data = {}
-    for i in range(1, 7):
-        country_category_data[i] = get_data(country_name, i)
+    combined_spec = get_spec('part3', country_name, chart_version('part3', country_name), lambda: get_country_chart(country_name))
+    with stage('emit', section='part3', key=country_name):
+        st.vega_lite_chart(combined_spec)
+
+# every country's sub-indicators, one row per country and year so it stays compact, sent once in client side mode
+def get_subindicator_data():
+    table = shared_view(dataset['subindicators'])
+    for dimension in name:
+        table = with_trend(table, dataset['trends'], dimension, year='Time', name='trend_' + dimension)
+    return table
+
+# member states whose dimensions and sub-domains are closest to a country in the latest edition,
+# read from the distance matrix of the shared dataset, None when the country has no scores to compare
+def peers_label(country_name):
+    with stage('peers', section='part3', key=country_name):
+        peers = nearest_countries(dataset['similarity'], country_name)
+    if not len(peers):
+        return None
+    return 'Most similar countries in %d across all dimensions and sub-domains: %s' % (
+        dataset['similarity']['years'][-1],
+        ', '.join('%s (%s)' % (row.CountryName, row.Country) for row in peers.itertuples()))
+
+def show_peers(country_name):
+    label = peers_label(country_name)
+    if label:
+        st.caption('<p style="font-size: 12px; color: grey;">%s</p>' % label, unsafe_allow_html=True)
+
+# all six category charts for every country, the country is picked by a dropdown inside the chart
+def get_all_countries_chart(default_country):
+    all_data = get_subindicator_data()
+    country_param = alt.param(
+        name='country',
+        value=default_country,
+        bind=alt.binding_select(options=country_options, name=COUNTRY_LABEL + ' ')
+    )
+
+    charts = {}
     for i in range(1, 7):
-        country_category_data[i] = pd.DataFrame(country_category_data[i])
-
-    # for each dimensions
-    for i in range(1, 7):
-        data = country_category_data[i]
-        data = data.melt(id_vars=['Time', 'Country'], var_name='Category', value_name='Index')
-        custom_color = {  
-            'WORK':'red',
-            'MONEY':'red',
-            'KNOWLEDGE':'red',
-            'TIME':'red',
-            'POWER':'red',
-            'HEALTH':'red',
-            'Participation':'purple', 
-            'Segregation and quality of work': 'purple',
-            'Financial resources':'purple', 
-            'Economic situation':'purple',
-            'Attainment and participation':'purple',
-            'Segregation':'purple',
-            'Care activities':'purple', 
-            'Social activities':'purple',
-            'Political':'purple', 
-            'Economic':'purple', 
-            'Social':'purple', 
-            'Status':'purple', 
-            'Behaviour':'purple', 
-            'Access':'purple'
-        }
-        
-        line = alt.Chart(data).mark_line().encode(
-            x='Time:O',
-            y=alt.Y('Index:Q', title='Index', scale=alt.Scale(domain=(50, 100))),
-            color=alt.Color('Category:N', scale=alt.Scale(domain=list(custom_color.keys()), range=list(custom_color.values()))),
-            tooltip=['Country', 'Index', 'Category']
+        base = alt.Chart(all_data).transform_filter(
+            alt.datum.Country == country_param
+        ).transform_fold(
+            list(category_mapping[i]), as_=['Category', 'Index']
         )
-
-        points = alt.Chart(data).mark_point().encode(
-            x='Time:O',
-            y=alt.Y('Index:Q', title='Index', scale=alt.Scale(domain=(50, 100))),
-            color=alt.Color('Category:N', scale=alt.Scale(domain=list(custom_color.keys()), range=list(custom_color.values()))),
-            tooltip=['Country', 'Index', 'Category']
+        trend_base = alt.Chart(all_data).transform_filter(
+            alt.datum.Country == country_param
         )
-
-        # create chart
-        chart = alt.layer(line, points).properties(
-            title=name[i - 1],
-            height=200,
-            width=300  
-        ).interactive()
-
-        # save chart
-        charts[i] = chart
+        charts[i] = category_layer(base, i, trend_base, 'trend_' + name[i - 1])
 
     first_row = alt.hconcat(charts[1], charts[2], charts[3])
     second_row = alt.hconcat(charts[4], charts[5], charts[6])
 
-    combined_chart = alt.vconcat(first_row, second_row)
-    st.altair_chart(combined_chart)
-
-# register
-on_country_change(country_dropdown)
+    # the peers caption of every country, the one of the picked country is shown under the charts
+    peers = pd.DataFrame({'Country': country_options, 'peers': [peers_label(c) or '' for c in country_options]})
+    peers_row = alt.Chart(peers).transform_filter(
+        alt.datum.Country == country_param
+    ).mark_text(align='left', baseline='middle', color='grey', fontSize=12).encode(
+        x=alt.value(0),
+        y=alt.value(10),
+        text='peers:N'
+    ).properties(height=20, view=alt.ViewBackground(stroke=None))
+
+    return alt.vconcat(first_row, second_row, peers_row).add_params(country_param)
+
+# selectbox and charts, a new country reruns only this section
+@st.fragment
+def country_section():
+    with fragment_run('part3'):
+        load_dataset()
+
+        # register
+        if client_side_switching:
+            all_countries_spec = get_spec('part3', 'all', chart_version('part3', 'all'), lambda: get_all_countries_chart(country_options[9]))
+            with stage('emit', section='part3', key='all'):
+                st.vega_lite_chart(all_countries_spec)
+        else:
+            country_dropdown = st.selectbox(COUNTRY_LABEL, country_options, index=9)
+            on_country_change(country_dropdown)
+            show_peers(country_dropdown)
+
+country_section()
 
 #xiugai8
 st.caption('<p style="font-size: 12px; color: grey;">Choose a country to see the detailed measurements of different dimensions to compare their contribution; Zoom in/out for adjusting the index axis</p>', unsafe_allow_html=True)
@@ -918,8 +757,51 @@ st.write(" ")
 
 
 
+#####################################
+###########   Warm-up    ############
+#####################################
+
+# once the first page is out, every dimension and country view is built in the background so no visitor
+# waits for a cold build, the default views first and then the most requested, turn off with WARM_UP=0
+warm_up_enabled = os.environ.get('WARM_UP', '1') == '1'
+
+@st.cache_resource(show_spinner=False)
+def start_warm_up(version, format):
+    views = [('part2', dimension, chart_version('part2', dimension), lambda dimension=dimension: get_dimension_chart(dimension), format)
+             for dimension in dimension_titles]
+    views += [('part3', country, chart_version('part3', country), lambda country=country: get_country_chart(country), 'vega-lite')
+              for country in country_options]
+    return warm_up(warm_up_order(views, first=[('part3', country_options[9]), ('part2', list(dimension_titles)[0])]))
+
+# in client side mode every dimension and country is already in the one chart of its part
+if warm_up_enabled and not client_side_switching:
+    start_warm_up(data_version, spec_format)
+
+
 #####################################
 ###########   Export    #############
 #####################################
 
+# every view of this page as a static bundle (HTML, optional PNG/SVG) for serving without a session:
+#   python export.py --formats png svg
+
+
+
+#####################################
+###########   Debug    ##############
+#####################################
 
+# stage timings of this run, always logged, shown in the sidebar only on request
+rerun_summary = finish_run(client=client_side_switching)
+
+if debug_panel:
+    with st.sidebar:
+        st.subheader('Rerun timing')
+        st.write('Total: %.1f ms' % (rerun_summary['seconds'] * 1000))
+        st.write('Workbook sheets parsed: %d' % rerun_summary['counters']['sheets_parsed'])
+        index_memory = memory_report(index_tidy)
+        st.write('Workbook table: %d rows, %.1f KB (%.1f KB with plain dtypes)' % (
+            index_memory['rows'], index_memory['compact_bytes'] / 1024, index_memory['loose_bytes'] / 1024))
+        st.dataframe(pd.DataFrame(stage_rows(rerun_summary)), hide_index=True, width='stretch')
+        st.subheader('Chart specs')
+        st.dataframe(pd.DataFrame(spec_rows(rerun_summary)), hide_index=True, width='stretch')
@@ -0,0 +1,256 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+import index_data
+import spec_cache
+from dashboard import APP_PATH, DIMENSION_LABEL, COUNTRY_LABEL, regressions
+
+#####################################
+#########   Benchmark    ############
+#####################################
+
+# Runs app.py headlessly with Streamlit's testing harness and records, for Part 1, every Part 2
+# dimension and every Part 3 country: wall time of the rerun, sheets parsed from the workbook and
+# the time it took, peak Python memory and the bytes of every chart spec sent to the browser.
+# Reruns are timed with tracemalloc off, it slows the interpreter down several times, the peak memory
+# of every first visit comes from a second pass over the same views started from the same caches.
+#
+#   python benchmark.py                                  # writes benchmark_results.json
+#   python benchmark.py --cold --repeat 5                # start without the parsed workbook cache
+#   python benchmark.py --baseline old.json              # exit 1 when a metric regressed
+
+# allowed growth over the baseline before a metric counts as a regression
+THRESHOLDS = {
+    'first_seconds': 0.25,
+    'median_seconds': 0.25,
+    'parse_seconds': 0.25,
+    'sheets_parsed': 0.0,
+    'peak_bytes': 0.20,
+    'spec_bytes': 0.05,
+}
+
+
+# workbook parsing is timed at the functions that read sheets, whichever loader calls them,
+# the counters are reset for every rerun
+parse_stats = {'sheets_parsed': 0, 'parse_seconds': 0.0}
+
+
+def timed(function, sheets):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            parse_stats['parse_seconds'] += time.perf_counter() - start
+        parse_stats['sheets_parsed'] += sheets(result)
+        return result
+    return wrapper
+
+
+# refresh_index and parse_index look both up in the module on every call
+index_data.parse_sheets = timed(index_data.parse_sheets, len)
+index_data.parse_index_pandas = timed(index_data.parse_index_pandas, lambda tidy: tidy['year'].nunique())
+
+
+# every chart element of the last run in page order
+def chart_protos(at):
+    protos = []
+
+    def walk(node):
+        for child in getattr(node, 'children', {}).values():
+            walk(child)
+        proto = getattr(node, 'proto', None)
+        if proto is not None and hasattr(proto, 'spec') and hasattr(proto, 'datasets'):
+            protos.append(proto)
+
+    walk(at._tree)
+    return protos
+
+
+def find_selectbox(at, label):
+    for selectbox in at.selectbox:
+        if selectbox.label == label:
+            return selectbox
+    return None
+
+
+# one rerun with its wall time and workbook parsing
+def measure(run):
+    for key in parse_stats:
+        parse_stats[key] = type(parse_stats[key])()
+    start = time.perf_counter()
+    at = run()
+    seconds = time.perf_counter() - start
+    if at.exception:
+        raise RuntimeError('app.py raised: %s' % at.exception[0].message)
+    return at, dict(parse_stats, seconds=seconds)
+
+
+# first visit and repeated visits of one view, chart_index picks the chart the view emits
+def record(results, section, key, run, chart_index, repeat):
+    at, first = measure(run)
+    repeats = [measure(run)[1] for _ in range(repeat)]
+    proto = chart_protos(at)[chart_index]
+    # the whole spec as compiled by Altair and after dataset projection and dedup, the chart sent is the
+    # latter with its datasets apart
+    compiled, deduped = spec_cache.spec_sizes().get('%s/%s/vega-lite' % (section, key), [None, None])
+    results.append({
+        'section': section,
+        'key': key,
+        'first_seconds': first['seconds'],
+        'median_seconds': statistics.median(r['seconds'] for r in repeats) if repeats else first['seconds'],
+        'sheets_parsed': first['sheets_parsed'] + sum(r['sheets_parsed'] for r in repeats),
+        'parse_seconds': first['parse_seconds'] + sum(r['parse_seconds'] for r in repeats),
+        'spec_bytes': len(proto.spec),
+        'compiled_spec_bytes': compiled,
+        'deduped_spec_bytes': deduped,
+        'dataset_bytes': sum(len(d.data.data) for d in proto.datasets),
+    })
+    return at
+
+
+# peak Python memory of the first visit of one view, traced in a pass of its own
+def record_peak(peaks, section, key, run, chart_index, repeat):
+    tracemalloc.reset_peak()
+    at = run()
+    if at.exception:
+        raise RuntimeError('app.py raised: %s' % at.exception[0].message)
+    peaks[(section, key)] = tracemalloc.get_traced_memory()[1]
+    return at
+
+
+# Part 1, every dimension and every country in one session, visit(section, key, run, chart_index, repeat)
+def visit_views(visit, repeat):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(APP_PATH, default_timeout=600)
+
+    # Part 1, the first run also loads the workbook
+    visit('part1', 'all', at.run, 0, repeat)
+
+    # Part 2, one rerun per dimension
+    dimensions = find_selectbox(at, DIMENSION_LABEL)
+    if dimensions is None:
+        visit('part2', 'all', at.run, 1, 0)
+    else:
+        for dimension in dimensions.options:
+            run = lambda dimension=dimension: find_selectbox(at, DIMENSION_LABEL).select(dimension).run()
+            visit('part2', dimension, run, 1, repeat)
+
+    # Part 3, one rerun per country
+    countries = find_selectbox(at, COUNTRY_LABEL)
+    if countries is None:
+        visit('part3', 'all', at.run, 2, 0)
+    else:
+        for country in countries.options:
+            run = lambda country=country: find_selectbox(at, COUNTRY_LABEL).select(country).run()
+            visit('part3', country, run, 2, repeat)
+
+
+# the parsed workbook and spec caches as they were before the timed pass, and nothing in memory
+def reset_caches(cold, saved):
+    import streamlit as st
+
+    st.cache_data.clear()
+    st.cache_resource.clear()
+    spec_cache.clear_memory()
+    shutil.rmtree(index_data.CACHE_DIR_NAME, ignore_errors=True)
+    if not cold:
+        shutil.copytree(saved, index_data.CACHE_DIR_NAME)
+
+
+def run_benchmark(repeat=3, cold=False, client=False):
+    os.chdir(os.path.dirname(APP_PATH))
+    if cold:
+        shutil.rmtree(index_data.CACHE_DIR_NAME, ignore_errors=True)
+    if client:
+        os.environ['CLIENT_SIDE_SWITCHING'] = '1'
+    # background builds would run into the timings, first visits are measured cold
+    os.environ.setdefault('WARM_UP', '0')
+    # one rerun record per visit would bury the report
+    os.environ.setdefault('DASHBOARD_LOG_LEVEL', 'WARNING')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        saved = os.path.join(tmp, 'cache')
+        if not cold and os.path.isdir(index_data.CACHE_DIR_NAME):
+            shutil.copytree(index_data.CACHE_DIR_NAME, saved)
+        else:
+            os.makedirs(saved)
+
+        results = []
+        visit_views(lambda *view: record(results, *view), repeat)
+
+        reset_caches(cold, saved)
+        peaks = {}
+        tracemalloc.start()
+        try:
+            visit_views(lambda *view: record_peak(peaks, *view), 0)
+        finally:
+            tracemalloc.stop()
+
+    for result in results:
+        result['peak_bytes'] = peaks[(result['section'], result['key'])]
+    return results
+
+
+def environment(args):
+    import altair
+    import streamlit
+
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'pandas': pd.__version__,
+        'altair': altair.__version__,
+        'streamlit': streamlit.__version__,
+        'repeat': args.repeat,
+        'cold': args.cold,
+        'client': args.client,
+    }
+
+
+def view_name(result):
+    return '%s/%s' % (result['section'], result['key'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark app.py reruns, workbook parsing and chart spec sizes.')
+    parser.add_argument('--repeat', type=int, default=3, help='warm reruns per view after the first visit')
+    parser.add_argument('--cold', action='store_true', help='delete the parsed workbook cache before starting')
+    parser.add_argument('--client', action='store_true', help='benchmark the client side switching mode')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', help='previous results to compare against')
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(repeat=args.repeat, cold=args.cold, client=args.client)
+    with open(args.output, 'w') as f:
+        json.dump({'environment': environment(args), 'results': results}, f, indent=2)
+
+    for r in results:
+        print('%-6s %-10s first %7.3fs  median %7.3fs  parsed %d sheets in %6.3fs  peak %6.1f MB  spec %7d B  data %7d B  dedup %s -> %s B' % (
+            r['section'], r['key'], r['first_seconds'], r['median_seconds'], r['sheets_parsed'], r['parse_seconds'],
+            r['peak_bytes'] / 1e6, r['spec_bytes'], r['dataset_bytes'], r['compiled_spec_bytes'], r['deduped_spec_bytes']))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), THRESHOLDS, view_name)
+        for line in found:
+            print('REGRESSION ' + line)
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
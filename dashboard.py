@@ -0,0 +1,35 @@
+import os
+
+#####################################
+#######   Shared by the tools   #####
+#####################################
+
+# what app.py and the scripts that drive it (benchmark.py, loadtest.py, export.py) have to agree on:
+# where the app is, the labels its selectboxes are found by and how a run is compared with a baseline
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+
+DIMENSION_LABEL = 'Choose A Dimension to Dive in:'
+COUNTRY_LABEL = 'Choose Country:'
+
+# timings that moved by less than this are scheduler noise, whatever the ratio
+NOISE_SECONDS = 0.05
+
+
+# metrics that grew past their threshold (allowed growth as a fraction) compared with a previous run,
+# name(result) identifies a result in both runs and labels it in the report, missing metrics are skipped
+def regressions(results, baseline, thresholds, name):
+    previous = {name(r): r for r in baseline['results']}
+    found = []
+    for result in results:
+        before = previous.get(name(result))
+        if before is None:
+            continue
+        for metric, tolerance in thresholds.items():
+            if result.get(metric) is None or before.get(metric) is None:
+                continue
+            slack = NOISE_SECONDS if metric.endswith('_seconds') else 0
+            if result[metric] > before[metric] * (1 + tolerance) + slack and result[metric] > before[metric]:
+                found.append('%s %s: %.4g -> %.4g (+%d%% allowed)' % (
+                    name(result), metric, before[metric], result[metric], tolerance * 100))
+    return found
@@ -0,0 +1,200 @@
+import json
+import os
+import sys
+
+import altair as alt
+
+from index_data import country_mapping, countryname_mapping
+
+#####################################
+##########   EU Map    ##############
+#####################################
+
+# EU member geometries as TopoJSON, served by Streamlit from static/ (see .streamlit/config.toml)
+# bump the version whenever the file is rebuilt so browsers never keep a stale copy
+EU_MAP_VERSION = 1
+EU_MAP_NAME = 'eu_countries_110m_v%d.json' % EU_MAP_VERSION
+EU_MAP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', EU_MAP_NAME)
+EU_MAP_URL = 'app/static/' + EU_MAP_NAME
+
+
+def eu_map_feature(url=EU_MAP_URL):
+    return alt.topo_feature(url, 'countries')
+
+
+# Natural Earth uses ISO 3166 alpha-3 codes, EIGE its own two letter codes
+iso3_mapping = {
+    'BE': 'BEL', 'BG': 'BGR', 'CZ': 'CZE', 'DK': 'DNK', 'DE': 'DEU', 'EE': 'EST',
+    'IE': 'IRL', 'EL': 'GRC', 'ES': 'ESP', 'FR': 'FRA', 'HR': 'HRV', 'IT': 'ITA',
+    'CY': 'CYP', 'LV': 'LVA', 'LT': 'LTU', 'LU': 'LUX', 'HU': 'HUN', 'MT': 'MLT',
+    'NL': 'NLD', 'AT': 'AUT', 'PL': 'POL', 'PT': 'PRT', 'RO': 'ROU', 'SI': 'SVN',
+    'SK': 'SVK', 'FI': 'FIN', 'SE': 'SWE'
+}
+
+# polygons outside this lon/lat box are overseas territories (French Guiana, Canary Islands, ...)
+EUROPE_BOUNDS = (-25, 34, 45, 72)
+
+# grid the coordinates are quantized to, and the simplification tolerance in grid units
+QUANTIZATION = 10000
+SIMPLIFY_TOLERANCE = 2
+
+
+#####################################
+#######   Build the asset   #########
+#####################################
+
+# rings of a shapefile polygon grouped into polygons, outer rings are clockwise, holes follow them
+def shape_polygons(shape):
+    bounds = list(shape.parts) + [len(shape.points)]
+    polygons = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        ring = [tuple(p) for p in shape.points[start:end]]
+        if signed_area(ring) <= 0 or not polygons:
+            polygons.append([ring])
+        else:
+            polygons[-1].append(ring)
+    return polygons
+
+
+def signed_area(ring):
+    return sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(ring, ring[1:])) / 2
+
+
+def in_europe(ring):
+    xs = [x for x, _ in ring]
+    ys = [y for _, y in ring]
+    x, y = (min(xs) + max(xs)) / 2, (min(ys) + max(ys)) / 2
+    x0, y0, x1, y1 = EUROPE_BOUNDS
+    return x0 <= x <= x1 and y0 <= y <= y1
+
+
+# EU member polygons by country code, read from a Natural Earth 110m admin 0 shapefile
+def read_countries(shapefile_path):
+    import shapefile  # pyshp, only needed to rebuild the asset
+
+    codes = {iso3: code for code, iso3 in iso3_mapping.items() if code in country_mapping}
+    countries = {}
+    with shapefile.Reader(shapefile_path) as reader:
+        iso_field = 'iso_a3' if 'iso_a3' in [f[0] for f in reader.fields] else 'ISO_A3'
+        for record, shape in zip(reader.records(), reader.shapes()):
+            code = codes.get(record[iso_field])
+            if code is None:
+                continue
+            polygons = [p for p in shape_polygons(shape) if in_europe(p[0])]
+            if polygons:
+                countries[code] = polygons
+    return countries
+
+
+# Douglas-Peucker on one arc, the end points stay so shared borders keep matching
+def simplify(points, tolerance):
+    if len(points) < 3:
+        return points
+    (x0, y0), (x1, y1) = points[0], points[-1]
+    dx, dy = x1 - x0, y1 - y0
+    norm = (dx * dx + dy * dy) ** 0.5
+    distances = [
+        abs(dy * x - dx * y + x1 * y0 - y1 * x0) / norm if norm else ((x - x0) ** 2 + (y - y0) ** 2) ** 0.5
+        for x, y in points[1:-1]
+    ]
+    i = max(range(len(distances)), key=distances.__getitem__)
+    if distances[i] <= tolerance:
+        return [points[0], points[-1]]
+    return simplify(points[:i + 2], tolerance)[:-1] + simplify(points[i + 1:], tolerance)
+
+
+# TopoJSON topology of the countries, borders between neighbours are stored once as shared arcs
+def build_topology(countries, quantization=QUANTIZATION, tolerance=SIMPLIFY_TOLERANCE):
+    coords = [p for polygons in countries.values() for polygon in polygons for ring in polygon for p in ring]
+    x0, y0 = min(x for x, _ in coords), min(y for _, y in coords)
+    x1, y1 = max(x for x, _ in coords), max(y for _, y in coords)
+    kx, ky = (x1 - x0) / (quantization - 1), (y1 - y0) / (quantization - 1)
+
+    # quantized closed rings without repeated points
+    rings = []
+    for code, polygons in countries.items():
+        for p, polygon in enumerate(polygons):
+            for ring in polygon:
+                q = []
+                for x, y in ring:
+                    point = (round((x - x0) / kx), round((y - y0) / ky))
+                    if not q or q[-1] != point:
+                        q.append(point)
+                if q[0] != q[-1]:
+                    q.append(q[0])
+                if len(q) >= 4:
+                    rings.append((code, p, q))
+
+    # which rings use each edge, a vertex where that changes is a junction
+    edge_rings = {}
+    for r, (_, _, ring) in enumerate(rings):
+        for a, b in zip(ring, ring[1:]):
+            edge_rings.setdefault(frozenset((a, b)), set()).add(r)
+
+    arcs, arc_index = [], {}
+    geometries = {}
+    for code, p, ring in rings:
+        points = ring[:-1]
+        n = len(points)
+        users = [edge_rings[frozenset((points[i], points[(i + 1) % n]))] for i in range(n)]
+        junctions = [i for i in range(n) if users[i] != users[i - 1]]
+
+        if junctions:
+            start = junctions[0]
+            points = points[start:] + points[:start]
+            cuts = [(j - start) % n for j in junctions] + [n]
+            pieces = [points[a:b] + [points[b % n]] for a, b in zip(cuts[:-1], cuts[1:])]
+        else:
+            pieces = [points + [points[0]]]
+
+        ring_arcs = []
+        for piece in pieces:
+            key = tuple(piece)
+            if key in arc_index:
+                ring_arcs.append(arc_index[key])
+            elif key[::-1] in arc_index:
+                ring_arcs.append(~arc_index[key[::-1]])
+            else:
+                arc_index[key] = len(arcs)
+                ring_arcs.append(len(arcs))
+                arcs.append(piece)
+        geometries.setdefault(code, {}).setdefault(p, []).append(ring_arcs)
+
+    # simplify each arc once so both sides of a border stay identical, then delta encode
+    encoded = []
+    for arc in arcs:
+        simplified = simplify(arc, tolerance)
+        if arc[0] == arc[-1] and len(simplified) < 4:
+            simplified = arc
+        delta, last = [], (0, 0)
+        for x, y in simplified:
+            delta.append([x - last[0], y - last[1]])
+            last = (x, y)
+        encoded.append(delta)
+
+    objects = []
+    for code, polygons in geometries.items():
+        polygons = [polygons[p] for p in sorted(polygons)]
+        geometry = {'id': country_mapping[code], 'properties': {'Country': code, 'CountryName': countryname_mapping[code]}}
+        if len(polygons) == 1:
+            geometry.update(type='Polygon', arcs=polygons[0])
+        else:
+            geometry.update(type='MultiPolygon', arcs=polygons)
+        objects.append(geometry)
+
+    return {
+        'type': 'Topology',
+        'transform': {'scale': [kx, ky], 'translate': [x0, y0]},
+        'objects': {'countries': {'type': 'GeometryCollection', 'geometries': objects}},
+        'arcs': encoded
+    }
+
+
+# usage: python eu_map.py path/to/ne_110m_admin_0_countries.shp (needs pyshp)
+if __name__ == '__main__':
+    topology = build_topology(read_countries(sys.argv[1]))
+    os.makedirs(os.path.dirname(EU_MAP_FILE), exist_ok=True)
+    with open(EU_MAP_FILE, 'w') as f:
+        json.dump(topology, f, separators=(',', ':'))
+    print('%s: %d countries, %d arcs, %d bytes' % (
+        EU_MAP_FILE, len(topology['objects']['countries']['geometries']), len(topology['arcs']), os.path.getsize(EU_MAP_FILE)))
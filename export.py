@@ -0,0 +1,335 @@
+import argparse
+import gzip
+import hashlib
+import html
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from index_data import WORKBOOK_PATH, DIMENSIONS, countryname_mapping, workbook_hash, load_index, index_digests, view_digest
+from spec_cache import spec_version, spec_path, read_spec
+from eu_map import EU_MAP_FILE, EU_MAP_NAME, EU_MAP_URL
+from dashboard import APP_PATH, DIMENSION_LABEL, COUNTRY_LABEL
+
+#####################################
+##########   Export    ##############
+#####################################
+
+# Static bundle of every dashboard view: Part 1, each Part 2 dimension and each Part 3 country as a
+# standalone HTML page, optionally also as PNG/SVG rendered locally by vl-convert. Shared assets
+# (the Vega JavaScript and the EU map) get content hashed names so a CDN can cache them forever,
+# and every text file is written next to a gzip copy for servers that send precompressed files.
+#
+#   python export.py                                     # writes the bundle to export/
+#   python export.py --formats png svg --jobs 4
+#   python export.py --force                             # rebuild views whose inputs did not change
+
+# the browser fallback when vl-convert is not installed to bundle the libraries
+CDN_SCRIPTS = [
+    'https://cdn.jsdelivr.net/npm/vega@6',
+    'https://cdn.jsdelivr.net/npm/vega-lite@6',
+    'https://cdn.jsdelivr.net/npm/vega-embed@7'
+]
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>%(title)s</title>
+%(scripts)s
+<style>body { font-family: sans-serif; margin: 24px; } h1 { color: purple; }</style>
+</head>
+<body>
+<h1>%(title)s</h1>
+<div id="vis"></div>
+<script>vegaEmbed('#vis', %(spec)s, {actions: false});</script>
+</body>
+</html>
+"""
+
+INDEX_PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>EU Gender Equality in 10 Years</title>
+<style>body { font-family: sans-serif; margin: 24px; } h1, h2 { color: purple; }</style>
+</head>
+<body>
+<h1>Unveiling the Evolution : EU Gender Equality in 10 Years</h1>
+%(sections)s
+</body>
+</html>
+"""
+
+SECTION_TITLES = {
+    'part1': 'Overview of EU Gender Equality in the Past Decade',
+    'part2': 'Gender Equality from Different Dimensions across EU Countries',
+    'part3': 'Comprehensive Indicators for Individual Countries'
+}
+
+
+# every exported view as (section, key), in page order
+def export_views():
+    return ([('part1', 'all')]
+            + [('part2', dimension) for dimension in DIMENSIONS]
+            + [('part3', country) for country in countryname_mapping])
+
+
+def page_name(section, key):
+    return '%s.html' % section if key == 'all' else '%s_%s.html' % (section, key)
+
+
+def view_title(section, key):
+    if section == 'part2':
+        return '%s: %s' % (SECTION_TITLES[section], key.capitalize())
+    if section == 'part3':
+        return '%s: %s' % (SECTION_TITLES[section], countryname_mapping[key])
+    return SECTION_TITLES[section]
+
+
+#####################################
+#######   Files and assets   ########
+#####################################
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:12]
+
+
+# write a file and, for text formats, its gzip copy, returns the paths relative to the bundle
+def write_file(out_dir, name, data, compress=True):
+    path = os.path.join(out_dir, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    files = [name]
+    outputs = [(path, data)]
+    if compress:
+        # mtime=0 keeps the compressed bytes identical between builds
+        outputs.append((path + '.gz', gzip.compress(data, compresslevel=9, mtime=0)))
+        files.append(name + '.gz')
+    for target, content in outputs:
+        tmp = '%s.%d.tmp' % (target, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(content)
+        os.replace(tmp, target)
+    return files
+
+
+# asset under a content hashed name, e.g. assets/eu_countries_110m_v1.3f2a9c0b1d4e.json
+def write_asset(out_dir, name, data):
+    stem, ext = os.path.splitext(name)
+    hashed = 'assets/%s.%s%s' % (stem, content_hash(data), ext)
+    if not os.path.exists(os.path.join(out_dir, hashed)):
+        write_file(out_dir, hashed, data)
+    return hashed
+
+
+# shared assets of the bundle, the JavaScript is bundled locally when vl-convert is available
+def write_assets(out_dir):
+    with open(EU_MAP_FILE, 'rb') as f:
+        assets = {'map': write_asset(out_dir, EU_MAP_NAME, f.read())}
+    try:
+        import vl_convert as vlc
+    except ImportError:
+        assets['scripts'] = CDN_SCRIPTS
+    else:
+        assets['scripts'] = [write_asset(out_dir, 'vega-bundle.js', vlc.javascript_bundle().encode())]
+    return assets
+
+
+# replace the data of every {"url": url, ...} node, used to point the map at the bundle or inline it
+def replace_url(node, url, data):
+    if isinstance(node, list):
+        return [replace_url(item, url, data) for item in node]
+    if not isinstance(node, dict):
+        return node
+    node = {k: replace_url(v, url, data) for k, v in node.items()}
+    if node.get('url') == url:
+        node = dict(data, **{k: v for k, v in node.items() if k != 'url'})
+    return node
+
+
+#####################################
+#########   View rendering   ########
+#####################################
+
+# one headless session per worker process, only started when a spec is not cached on disk yet
+_app = None
+
+
+def run_view(section, key):
+    global _app
+    from streamlit.testing.v1 import AppTest
+
+    if _app is None:
+        _app = AppTest.from_file(APP_PATH, default_timeout=600)
+        _app.run()
+    label = {'part2': DIMENSION_LABEL, 'part3': COUNTRY_LABEL}.get(section)
+    if label:
+        selectbox = next(s for s in _app.selectbox if s.label == label)
+        selectbox.select(key).run()
+    if _app.exception:
+        raise RuntimeError('app.py raised: %s' % _app.exception[0].message)
+
+
+# compiled spec of a view from the spec cache the dashboard fills, rendered by the app when missing
+def view_spec(section, key, version):
+    spec = read_spec(spec_path(section, key, version))
+    if spec is None:
+        run_view(section, key)
+        spec = read_spec(spec_path(section, key, version))
+    if spec is None:
+        raise RuntimeError('no spec for %s/%s after running app.py' % (section, key))
+    return spec
+
+
+def init_worker(app_dir):
+    # the app reads its workbook relative to its folder and must render the selectbox views
+    os.chdir(app_dir)
+    os.environ['CLIENT_SIDE_SWITCHING'] = '0'
+    os.environ['SERVER_SIDE_TRANSFORMS'] = '0'
+    # every worker builds only its own views
+    os.environ['WARM_UP'] = '0'
+    os.environ.setdefault('DASHBOARD_LOG_LEVEL', 'WARNING')
+
+
+# render one view into the bundle, returns its manifest entry
+def export_view(section, key, version, out_dir, assets, formats):
+    start = time.perf_counter()
+    spec = view_spec(section, key, version)
+    name = page_name(section, key)
+    title = view_title(section, key)
+
+    page_spec = replace_url(spec, EU_MAP_URL, {'url': assets['map']})
+    scripts = '\n'.join('<script src="%s"></script>' % html.escape(src) for src in assets['scripts'])
+    page = PAGE % {
+        'title': html.escape(title),
+        # a closing script tag inside the data would end the inline script early
+        'spec': json.dumps(page_spec, separators=(',', ':')).replace('</', '<\\/'),
+        'scripts': scripts
+    }
+    files = write_file(out_dir, name, page.encode())
+
+    if formats:
+        import vl_convert as vlc
+
+        with open(EU_MAP_FILE) as f:
+            render_spec = replace_url(spec, EU_MAP_URL, {'values': json.load(f)})
+        stem = os.path.splitext(name)[0]
+        if 'svg' in formats:
+            files += write_file(out_dir, 'images/%s.svg' % stem, vlc.vegalite_to_svg(render_spec).encode())
+        if 'png' in formats:
+            files += write_file(out_dir, 'images/%s.png' % stem, vlc.vegalite_to_png(render_spec, scale=2), compress=False)
+
+    return {'section': section, 'key': key, 'title': title, 'page': name, 'files': files,
+            'seconds': time.perf_counter() - start}
+
+
+#####################################
+#######   Incremental build   #######
+#####################################
+
+def read_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, 'manifest.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'views': {}}
+
+
+# everything an exported view depends on, a view is rebuilt only when this changes
+def build_key(version, assets, formats):
+    return hashlib.sha256(json.dumps([version, assets, sorted(formats)]).encode()).hexdigest()[:16]
+
+
+def up_to_date(entry, key, out_dir):
+    return entry is not None and entry.get('build_key') == key and all(
+        os.path.exists(os.path.join(out_dir, name)) for name in entry['files'])
+
+
+def write_index(out_dir, entries):
+    sections = []
+    for section, title in SECTION_TITLES.items():
+        links = ''.join('<li><a href="%s">%s</a></li>' % (e['page'], html.escape(e['title']))
+                        for e in entries if e['section'] == section)
+        sections.append('<h2>%s</h2>\n<ul>%s</ul>' % (html.escape(title), links))
+    return write_file(out_dir, 'index.html', (INDEX_PAGE % {'sections': '\n'.join(sections)}).encode())
+
+
+# drop hashed assets and images that no view refers to anymore
+def prune(out_dir, keep):
+    for folder in ('assets', 'images'):
+        path = os.path.join(out_dir, folder)
+        if not os.path.isdir(path):
+            continue
+        for name in os.listdir(path):
+            if '%s/%s' % (folder, name) not in keep:
+                os.remove(os.path.join(path, name))
+
+
+def export(out_dir='export', formats=(), jobs=None, force=False, views=None):
+    app_dir = os.path.dirname(APP_PATH)
+    out_dir = os.path.abspath(out_dir)
+    init_worker(app_dir)
+
+    # spec versions as app.py computes them, each view is versioned on its own rows
+    data_version = workbook_hash(WORKBOOK_PATH)
+    digests = index_digests(load_index(WORKBOOK_PATH, digest=data_version))
+    views = views or export_views()
+    versions = {view: spec_version(view_digest(digests, data_version, *view), APP_PATH) for view in views}
+
+    assets = write_assets(out_dir)
+    keys = {view: build_key(versions[view], assets, formats) for view in views}
+
+    manifest = read_manifest(out_dir)
+    entries, todo = {}, []
+    for section, view_key in views:
+        entry = manifest['views'].get('%s/%s' % (section, view_key))
+        if not force and up_to_date(entry, keys[(section, view_key)], out_dir):
+            entries[(section, view_key)] = entry
+        else:
+            todo.append((section, view_key))
+
+    # worker processes each keep a headless session, so views whose spec is not cached build in parallel too,
+    # they are spawned since vl-convert's runtime threads do not survive a fork
+    if todo:
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=jobs, mp_context=context, initializer=init_worker, initargs=(app_dir,)) as pool:
+            futures = {view: pool.submit(export_view, view[0], view[1], versions[view], out_dir, assets, formats) for view in todo}
+            for view, future in futures.items():
+                entries[view] = dict(future.result(), build_key=keys[view])
+
+    ordered = [entries[view] for view in views]
+    files = write_index(out_dir, ordered)
+    manifest = {
+        'version': data_version,
+        'assets': assets,
+        'views': {'%s/%s' % (e['section'], e['key']): e for e in ordered}
+    }
+    files += write_file(out_dir, 'manifest.json', json.dumps(manifest, indent=2).encode(), compress=False)
+    prune(out_dir, {name for e in ordered for name in e['files']}
+          | {name for src in assets['scripts'] + [assets['map']] for name in (src, src + '.gz')})
+    return ordered, todo
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export every dashboard view as a static bundle.')
+    parser.add_argument('--output', default='export', help='bundle folder')
+    parser.add_argument('--formats', nargs='*', default=[], choices=['png', 'svg'], help='also render images')
+    parser.add_argument('--jobs', type=int, default=None, help='worker processes, defaults to the CPU count')
+    parser.add_argument('--force', action='store_true', help='rebuild views whose inputs did not change')
+    args = parser.parse_args(argv)
+
+    entries, built = export(args.output, args.formats, args.jobs, args.force)
+    for e in entries:
+        status = 'built %.2fs' % e['seconds'] if (e['section'], e['key']) in built else 'unchanged'
+        print('%-24s %s' % (e['page'], status))
+    print('%d views, %d rebuilt -> %s' % (len(entries), len(built), os.path.abspath(args.output)))
+    return 0
+
+
+if __name__ == '__main__':
+    # go through the importable module, the headless app replaces __main__ in the workers
+    import export
+    sys.exit(export.main())
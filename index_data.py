@@ -0,0 +1,738 @@
+import hashlib
+import logging
+import multiprocessing
+import os
+import posixpath
+import re
+import threading
+import time
+import zipfile
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from xml.etree import ElementTree
+
+import numpy as np
+import pandas as pd
+import pyarrow.feather as feather
+
+from timing import count
+
+#####################################
+########   Index Workbook   #########
+#####################################
+
+# Gender Equality Index workbook, one sheet per EIGE edition
+WORKBOOK_PATH = 'index_file.xlsx'
+
+# every score column the dashboard reads from a sheet
+MEASURES = [
+    'Gender Equality Index',
+    'WORK', 'Participation', 'Segregation and quality of work',
+    'MONEY', 'Financial resources', 'Economic situation',
+    'KNOWLEDGE', 'Attainment and participation', 'Segregation',
+    'TIME', 'Care activities', 'Social activities',
+    'POWER', 'Political', 'Economic', 'Social',
+    'HEALTH', 'Status', 'Behaviour', 'Access'
+]
+
+# the six dimensions of the index, each scored for every country and year
+DIMENSIONS = ['WORK', 'MONEY', 'KNOWLEDGE', 'TIME', 'POWER', 'HEALTH']
+
+# country name dictionary
+countryname_mapping = {
+    'BE': 'Belgium',
+    'BG': 'Bulgaria',
+    'CZ': 'Czech Republic',
+    'DK': 'Denmark',
+    'DE': 'Germany',
+    'EE': 'Estonia',
+    'IE': 'Ireland',
+    'EL': 'Greece',
+    'ES': 'Spain',
+    'FR': 'France',
+    'HR': 'Croatia',
+    'IT': 'Italy',
+    'CY': 'Cyprus',
+    'LV': 'Latvia',
+    'LT': 'Lithuania',
+    'LU': 'Luxembourg',
+    'HU': 'Hungary',
+    'MT': 'Malta',
+    'NL': 'Netherlands',
+    'AT': 'Austria',
+    'PL': 'Poland',
+    'PT': 'Portugal',
+    'RO': 'Romania',
+    'SI': 'Slovenia',
+    'SK': 'Slovakia',
+    'FI': 'Finland',
+    'SE': 'Sweden'
+}
+
+# numeric ISO 3166 ids of the map geometries, Malta is too small for the 110m map
+country_mapping = {
+    'BE': 56,
+    'BG': 100,
+    'CZ': 203,
+    'DK': 208,
+    'DE': 276,
+    'EE': 233,
+    'IE': 372,
+    'EL': 300,
+    'ES': 724,
+    'FR': 250,
+    'HR': 191,
+    'IT': 380,
+    'CY': 196,
+    'LV': 428,
+    'LT': 440,
+    'LU': 442,
+    'HU': 348,
+    #'MT': 'Malta',
+    'NL': 528,
+    'AT': 40,
+    'PL': 616,
+    'PT': 620,
+    'RO': 642,
+    'SI': 705,
+    'SK': 703,
+    'FI': 246,
+    'SE': 752
+}
+
+
+# parsed copies of the workbook live next to it, one file per workbook content hash
+# and one per sheet content fingerprint, so a new edition only parses its own sheet
+CACHE_DIR_NAME = '.index_cache'
+SHEET_CACHE_DIR_NAME = 'sheets'
+
+# layout of the cached tables, bump whenever their columns or dtypes change
+CACHE_FORMAT = 2
+
+# worker processes that parse sheets side by side, INDEX_PARSE_WORKERS=1 parses in this process,
+# defaults to the CPU count
+PARSE_WORKERS = int(os.environ.get('INDEX_PARSE_WORKERS', '0')) or os.cpu_count() or 1
+
+# fewer sheets than this are parsed serially, openpyxl reads one in about 25 ms
+# while starting a worker and importing pandas in it takes several hundred
+PARALLEL_MIN_SHEETS = 16
+
+# decimals of the scores handed to the charts, float32 keeps about seven significant digits
+SCORE_DECIMALS = 4
+
+logger = logging.getLogger(__name__)
+
+# path -> (mtime, size, hash), the file is only read again once it was touched
+_hashes = {}
+
+
+# content hash of the workbook, changes whenever EIGE data is updated
+def workbook_hash(path=WORKBOOK_PATH):
+    stat = os.stat(path)
+    known = _hashes.get(os.path.abspath(path))
+    if known and known[:2] == (stat.st_mtime_ns, stat.st_size):
+        return known[2]
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    _hashes[os.path.abspath(path)] = (stat.st_mtime_ns, stat.st_size, digest.hexdigest())
+    return digest.hexdigest()
+
+
+def cache_path(path=WORKBOOK_PATH, digest=None):
+    digest = digest or workbook_hash(path)
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)), CACHE_DIR_NAME)
+    return os.path.join(cache_dir, 'index_%s_v%d.arrow' % (digest[:16], CACHE_FORMAT))
+
+
+# long table for the workbook, read from the columnar cache when its hash matches
+def load_index(path=WORKBOOK_PATH, use_cache=True, digest=None):
+    if not use_cache:
+        return parse_index(path)
+
+    cached = cache_path(path, digest)
+    if os.path.exists(cached):
+        try:
+            return feather.read_feather(cached, memory_map=True)
+        except Exception:
+            # unreadable cache, e.g. a half written file from a killed process, rebuild it
+            pass
+
+    tidy = refresh_index(path)
+    write_cache(tidy, cached)
+    return tidy
+
+
+# store the long table uncompressed so it can be memory mapped, drop caches of older workbooks
+def write_cache(tidy, cached, prefix='index_', prune=True):
+    cache_dir = os.path.dirname(cached)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = '%s.%d.%d.tmp' % (cached, os.getpid(), threading.get_ident())
+        feather.write_feather(tidy, tmp, compression='uncompressed')
+        os.replace(tmp, cached)
+        for old in os.listdir(cache_dir) if prune else []:
+            if old.startswith(prefix) and old.endswith('.arrow') and old != os.path.basename(cached):
+                os.remove(os.path.join(cache_dir, old))
+    except OSError:
+        # read-only deployments still work, they just parse the workbook every start
+        pass
+
+
+# read every sheet once and stack them into one long table (year, Country, measure, value)
+def parse_index(path=WORKBOOK_PATH):
+    if not path.endswith(('.xlsx', '.xlsm')):
+        # openpyxl only streams OOXML workbooks, older formats go through pandas
+        return parse_index_pandas(path)
+
+    frames = [sheet_frame(*columns) for _, *columns in parse_sheets(path)]
+    return tidy_frame(frames)
+
+
+# columns of every sheet (or of the named ones) in workbook order, spread over a process pool when there
+# are enough of them, each worker opens the workbook itself and streams only its own sheets
+def parse_sheets(path, sheet_names=None, workers=None):
+    workers = workers or PARSE_WORKERS
+    names = workbook_sheet_names(path)
+    if sheet_names is not None:
+        names = [name for name in names if name in sheet_names]
+    count('sheets_parsed', len(names))
+    if workers < 2 or len(names) < PARALLEL_MIN_SHEETS:
+        return list(stream_sheets(path, sheet_names=set(names)))
+
+    # no more workers than sheets, an empty chunk would only start a process that opens the workbook for nothing
+    workers = min(workers, len(names))
+    # spawned rather than forked, the parent may be a Streamlit server with threads holding locks
+    chunks = [names[i::workers] for i in range(workers)]
+    context = multiprocessing.get_context('spawn')
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            parsed = {sheet[0]: sheet for chunk in pool.map(parse_sheet_chunk, [path] * len(chunks), chunks) for sheet in chunk}
+    except (BrokenProcessPool, OSError):
+        # no worker could start, e.g. a sandbox without process creation, parse here instead
+        logger.warning('workbook %s: parallel parsing failed, parsing %d sheets serially', path, len(names), exc_info=True)
+        return list(stream_sheets(path, sheet_names=set(names)))
+    return [parsed[name] for name in names if name in parsed]
+
+
+def parse_sheet_chunk(path, sheet_names):
+    return list(stream_sheets(path, sheet_names=set(sheet_names)))
+
+
+def workbook_sheet_names(path):
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(path, read_only=True, keep_links=False)
+    try:
+        return list(workbook.sheetnames)
+    finally:
+        workbook.close()
+
+
+# columns of every sheet (or of the named ones), streamed in read-only mode so only the projected cells are ever held
+def stream_sheets(path, measures=MEASURES, sheet_names=None):
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True, keep_links=False)
+    try:
+        for sheet in workbook.worksheets:
+            if sheet_names is not None and sheet.title not in sheet_names:
+                continue
+            header = next(sheet.iter_rows(max_row=1, values_only=True), None)
+            if header is None:
+                continue
+            positions = {name: i for i, name in enumerate(header) if name is not None}
+            wanted = [positions[column] for column in ['Index year', 'Country'] + list(measures)]
+
+            # cells right of the last needed column are never read, scores go straight into float arrays
+            years, countries = [], []
+            scores = [array('d') for _ in measures]
+            for row in sheet.iter_rows(min_row=2, max_col=max(wanted) + 1, values_only=True):
+                values = [row[i] if i < len(row) else None for i in wanted]
+                if all(v is None for v in values):
+                    continue
+                years.append(values[0])
+                countries.append(values[1])
+                for column, value in zip(scores, values[2:]):
+                    column.append(float('nan') if value is None else float(value))
+            yield sheet.title, years, countries, dict(zip(measures, scores))
+    finally:
+        workbook.close()
+
+
+# long rows of one sheet in the order DataFrame.melt gives, measure by measure
+def sheet_frame(years, countries, scores):
+    n = len(years)
+    return pd.DataFrame({
+        'year': years * len(scores),
+        'Country': countries * len(scores),
+        'measure': [measure for measure in scores for _ in range(n)],
+        'value': np.concatenate([np.frombuffer(values, dtype=np.float64) for values in scores.values()]) if scores else []
+    })
+
+
+def parse_index_pandas(path=WORKBOOK_PATH):
+    sheets = pd.read_excel(path, sheet_name=None, usecols=['Index year', 'Country'] + MEASURES)
+    count('sheets_parsed', len(sheets))
+
+    frames = []
+    for sheet_name, df in sheets.items():
+        df = df.rename(columns={'Index year': 'year'})
+        frames.append(df.melt(id_vars=['year', 'Country'], value_vars=MEASURES, var_name='measure', value_name='value'))
+    return tidy_frame(frames)
+
+
+# stacked sheets in the compact dtypes every session shares: small integer years, country and measure
+# codes as categories and float32 scores, years become strings and scores float64 only in the chart frames
+def tidy_frame(frames):
+    tidy = pd.concat(frames, axis=0, ignore_index=True)
+    return pd.DataFrame({
+        'year': tidy['year'].astype('int16'),
+        'Country': tidy['Country'].astype(str).astype('category'),
+        'measure': tidy['measure'].astype(str).astype('category'),
+        'value': tidy['value'].astype('float32')
+    })
+
+
+def frame_bytes(df):
+    return int(df.memory_usage(deep=True).sum())
+
+
+# bytes of the long table as it is held, and as it would be with plain int64, string and float64 columns
+def memory_report(tidy):
+    loose = pd.DataFrame({
+        'year': tidy['year'].astype('int64'),
+        'Country': tidy['Country'].astype(str),
+        'measure': tidy['measure'].astype(str),
+        'value': tidy['value'].astype('float64')
+    })
+    return {'rows': len(tidy), 'loose_bytes': frame_bytes(loose), 'compact_bytes': frame_bytes(tidy)}
+
+
+# scores as the charts get them, float64 rounded so float32 noise never reaches a tooltip
+def chart_scores(values):
+    return values.astype('float64').round(SCORE_DECIMALS)
+
+
+#####################################
+#######   Incremental refresh   #####
+#####################################
+
+# cells of a worksheet part, with their reference, type and value or inline string
+CELL = re.compile(rb'<c\b([^>]*?)(?:/>|>(.*?)</c>)', re.S)
+CELL_REF = re.compile(rb'\br="([^"]*)"')
+CELL_TYPE = re.compile(rb'\bt="([^"]*)"')
+CELL_VALUE = re.compile(rb'<v>([^<]*)</v>')
+CELL_TEXT = re.compile(rb'<t\b[^>]*>([^<]*)</t>')
+
+XLSX_MAIN = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+XLSX_RELATIONSHIP = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id'
+
+
+# sheet name -> fingerprint of its cell values, read from the zip members without building any cell object,
+# styles, column widths and the selected tab do not change it
+def sheet_fingerprints(path=WORKBOOK_PATH):
+    with zipfile.ZipFile(path) as archive:
+        strings = shared_strings(archive)
+        fingerprints = {}
+        for name, member in sheet_members(archive):
+            xml = archive.read(member)
+            digest = hashlib.sha256()
+            cells = 0
+            for attributes, body in CELL.findall(xml):
+                value = CELL_VALUE.search(body)
+                if value is not None:
+                    value = value.group(1)
+                elif b'<is>' in body:
+                    value = b''.join(CELL_TEXT.findall(body))
+                else:
+                    continue
+                kind = CELL_TYPE.search(attributes)
+                kind = kind.group(1) if kind else b'n'
+                if kind == b's':
+                    # text cells only hold an index into the shared strings, hash the string itself
+                    value = strings[int(value)].encode()
+                ref = CELL_REF.search(attributes)
+                digest.update(b'\x1f'.join([ref.group(1) if ref else b'', kind, value]) + b'\x1e')
+                cells += 1
+            if not cells:
+                # cells written in a form the patterns do not know, fall back to the raw part
+                digest.update(xml)
+            fingerprints[name] = digest.hexdigest()
+        return fingerprints
+
+
+def shared_strings(archive):
+    if 'xl/sharedStrings.xml' not in archive.namelist():
+        return []
+    with archive.open('xl/sharedStrings.xml') as f:
+        return [''.join(t.text or '' for t in si.iter(XLSX_MAIN + 't'))
+                for si in ElementTree.parse(f).getroot().iter(XLSX_MAIN + 'si')]
+
+
+# (sheet name, zip member of its cells) in workbook order
+def sheet_members(archive):
+    workbook = ElementTree.fromstring(archive.read('xl/workbook.xml'))
+    relationships = ElementTree.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+    targets = {r.get('Id'): r.get('Target') for r in relationships}
+    members = []
+    for sheet in workbook.iter(XLSX_MAIN + 'sheet'):
+        target = targets[sheet.get(XLSX_RELATIONSHIP)]
+        member = target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join('xl', target))
+        members.append((sheet.get('name'), member))
+    return members
+
+
+def sheet_cache_path(path, fingerprint):
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)), CACHE_DIR_NAME, SHEET_CACHE_DIR_NAME)
+    return os.path.join(cache_dir, 'sheet_%s_v%d.arrow' % (fingerprint[:16], CACHE_FORMAT))
+
+
+# long table of the workbook, sheets whose fingerprint was seen before come from their own cache,
+# only new or edited sheets are parsed
+def refresh_index(path=WORKBOOK_PATH):
+    if not path.endswith(('.xlsx', '.xlsm')):
+        return parse_index(path)
+
+    fingerprints = sheet_fingerprints(path)
+    frames, changed = {}, []
+    for name, fingerprint in fingerprints.items():
+        try:
+            frames[name] = feather.read_feather(sheet_cache_path(path, fingerprint))
+        except Exception:
+            changed.append(name)
+
+    if changed:
+        for name, *columns in parse_sheets(path, sheet_names=set(changed)):
+            frames[name] = tidy_frame([sheet_frame(*columns)])
+            write_cache(frames[name], sheet_cache_path(path, fingerprints[name]), prefix='sheet_', prune=False)
+        logger.info('workbook %s: parsed %d of %d sheets (%s)', path, len(changed), len(fingerprints), ', '.join(changed))
+
+    prune_sheet_cache(path, fingerprints.values())
+    tidy = tidy_frame([frames[name] for name in fingerprints if name in frames])
+    report = memory_report(tidy)
+    logger.info('workbook %s: %d rows in %d bytes, %d with plain dtypes',
+                path, report['rows'], report['compact_bytes'], report['loose_bytes'])
+    return tidy
+
+
+# sheet caches of sheets that are no longer in the workbook
+def prune_sheet_cache(path, fingerprints):
+    keep = {os.path.basename(sheet_cache_path(path, f)) for f in fingerprints}
+    cache_dir = os.path.dirname(sheet_cache_path(path, ''))
+    try:
+        for old in os.listdir(cache_dir):
+            if old.startswith('sheet_') and old.endswith('.arrow') and old not in keep:
+                os.remove(os.path.join(cache_dir, old))
+    except OSError:
+        pass
+
+
+# poll the workbook and refresh the parsed cache in the background as soon as it changes,
+# reruns after an update then only read the cache instead of all parsing at once
+def watch_workbook(path=WORKBOOK_PATH, interval=5.0):
+    def watch():
+        seen = None
+        while True:
+            try:
+                stat = os.stat(path)
+                if (stat.st_mtime_ns, stat.st_size) != seen:
+                    load_index(path, digest=workbook_hash(path))
+                    seen = (stat.st_mtime_ns, stat.st_size)
+            except Exception:
+                # the file may be half written, try again on the next poll
+                logger.exception('refreshing %s failed', path)
+            time.sleep(interval)
+
+    thread = threading.Thread(target=watch, name='workbook-watcher', daemon=True)
+    thread.start()
+    return thread
+
+
+# content digest of every measure and every country, views are versioned on the rows they show
+def index_digests(tidy):
+    rows = pd.Series(pd.util.hash_pandas_object(tidy, index=False).to_numpy(), index=tidy.index)
+
+    def digests(key):
+        return {name: hashlib.sha256(group.to_numpy().tobytes()).hexdigest()[:16]
+                for name, group in rows.groupby(tidy[key].to_numpy(), sort=False)}
+
+    return {'measure': digests('measure'), 'Country': digests('Country')}
+
+
+# the rows a dashboard view depends on: Part 1 the index, Part 2 one dimension, Part 3 one country,
+# views over everything use the whole workbook
+def view_digest(digests, data_version, section, key):
+    if section == 'part1':
+        return digests['measure']['Gender Equality Index']
+    if section == 'part2' and key in digests['measure']:
+        return digests['measure'][key]
+    if section == 'part3' and key in digests['Country']:
+        return digests['Country'][key]
+    return data_version
+
+
+# running sums and counts of a score per country over the years, one row per country with columns
+# sum_<i> and count_<i> for the i-th year, the mean over years lo..hi is
+# (sum_hi - sum_lo-1) / (count_hi - count_lo-1), constant time for any interval
+def year_cube(df, value, index='Country', column='year'):
+    wide = df.pivot(index=index, columns=column, values=value).reindex(columns=sorted(df[column].unique()))
+    years = list(wide.columns)
+    sums = wide.fillna(0).cumsum(axis=1)
+    counts = wide.notna().cumsum(axis=1)
+    sums.columns = ['sum_%d' % i for i in range(len(years))]
+    counts.columns = ['count_%d' % i for i in range(len(years))]
+    cube = pd.concat([sums, counts], axis=1).reset_index()
+    cube.columns.name = None
+    return cube, years
+
+
+# several measures for every country, one row per (Time, Country) and one column per measure
+def subindicator_table(tidy, measures):
+    df = tidy[tidy['measure'].isin(measures)]
+    rows = pd.MultiIndex.from_frame(df[['year', 'Country']].drop_duplicates())
+    df = df.pivot(index=['year', 'Country'], columns='measure', values='value').reindex(rows).reset_index()
+    df = df.rename(columns={'year': 'Time'})
+    df['Time'] = df['Time'].astype(str)
+    df['Country'] = df['Country'].astype(str)
+    df.columns.name = None
+    df = df[['Time', 'Country'] + list(measures)]
+    df[list(measures)] = chart_scores(df[list(measures)])
+    return df
+
+
+# one measure for every country and year, the shape Part 1 and Part 2 charts use
+def measure_frame(tidy, measure, name=None):
+    df = tidy.loc[tidy['measure'] == measure, ['year', 'Country', 'value']]
+    df = df.rename(columns={'value': name or measure}).reset_index(drop=True)
+    df['year'] = df['year'].astype(str)
+    df['Country'] = df['Country'].astype(str)
+    df[name or measure] = chart_scores(df[name or measure])
+    return df
+
+
+# several measures for a single country, one column per measure, the shape Part 3 charts use
+def country_frame(tidy, country_name, measures):
+    df = tidy[(tidy['Country'] == country_name) & tidy['measure'].isin(measures)]
+    df = df.pivot(index=['year', 'Country'], columns='measure', values='value').reset_index()
+    df = df.rename(columns={'year': 'Time'})
+    df['Time'] = df['Time'].astype(str)
+    df['Country'] = df['Country'].astype(str)
+    df.columns.name = None
+    df = df[['Time', 'Country'] + list(measures)]
+    df[list(measures)] = chart_scores(df[list(measures)])
+    return df
+
+
+# every dimension of every (year, country) with its yearly rank, map id and country name, in one pass
+def dimension_table(tidy, dimensions=DIMENSIONS):
+    scores = tidy[tidy['measure'].isin(dimensions)]
+    rows = pd.MultiIndex.from_frame(scores[['year', 'Country']].drop_duplicates())
+
+    # (year, country) x dimension matrix, ranked within each year for all dimensions at once
+    wide = scores.pivot(index=['year', 'Country'], columns='measure', values='value').reindex(rows)[list(dimensions)]
+    ranks = wide.groupby(level='year').rank(method='min', ascending=False)
+
+    table = pd.concat({'value': wide, 'rank': ranks}, axis=1).stack(level='measure').reset_index()
+    table['Country'] = table['Country'].astype(str)
+    table['measure'] = table['measure'].astype(str)
+    table['value'] = chart_scores(table['value'])
+    table['id'] = table['Country'].map(country_mapping)
+    table['CountryName'] = table['Country'].map(countryname_mapping)
+    return table
+
+
+# color and axis domain of each dimension
+def dimension_bounds(table):
+    return table.groupby('measure')['value'].agg(['min', 'max'])
+
+
+# one dimension of the precomputed table, the shape Part 2 charts use
+def dimension_frame(table, dimension):
+    df = table.loc[table['measure'] == dimension, ['year', 'Country', 'value', 'id', 'CountryName', 'rank']]
+    df = df.rename(columns={'value': dimension}).reset_index(drop=True)
+    df['year'] = df['year'].astype(str)
+    return df
+
+
+# every dimension side by side, one row per (year, country) with the score and rank_<dimension> columns
+def dimension_wide(table):
+    rows = pd.MultiIndex.from_frame(table[['year', 'Country']].drop_duplicates())
+    dimensions = list(table['measure'].drop_duplicates())
+    wide = table.pivot(index=['year', 'Country'], columns='measure', values=['value', 'rank']).reindex(rows)
+    wide.columns = [measure if kind == 'value' else 'rank_' + measure for kind, measure in wide.columns]
+    wide = wide.reset_index()
+    wide['id'] = wide['Country'].map(country_mapping)
+    wide['CountryName'] = wide['Country'].map(countryname_mapping)
+    wide['year'] = wide['year'].astype(str)
+    return wide[['year', 'Country', 'id', 'CountryName'] + dimensions + ['rank_' + d for d in dimensions]]
+
+
+#####################################
+#########   Shared Dataset   ########
+#####################################
+
+# every score column of the sub-indicator charts, the dimensions followed by their sub-domains
+SUBINDICATORS = [measure for measure in MEASURES if measure != 'Gender Equality Index']
+
+
+# everything the dashboard derives from one workbook version, built once per process and never written
+# to afterwards, map ids, country names and ranks are added here instead of on every rerun
+def build_dataset(path=WORKBOOK_PATH, digest=None):
+    tidy = load_index(path, digest=digest)
+    table = dimension_table(tidy, DIMENSIONS)
+    subindicators = subindicator_table(tidy, SUBINDICATORS)
+    return {
+        'version': digest or workbook_hash(path),
+        'tidy': tidy,
+        'digests': index_digests(tidy),
+        'dimension_table': table,
+        'dimension_bounds': dimension_bounds(table),
+        'dimension_wide': dimension_wide(table),
+        'subindicators': subindicators[subindicators['Country'].isin(countryname_mapping)].reset_index(drop=True),
+        'similarity': similarity_matrix(tidy),
+        'trends': trend_table(tidy)
+    }
+
+
+# what a session gets of a shared frame, with copy on write (always on since pandas 3, hence the pin in
+# requirements.txt) the view shares every column with the dataset and a session that adds or overwrites
+# a column only changes its own view
+def shared_view(frame):
+    return frame.copy(deep=False)
+
+
+#####################################
+########   Country Peers   ##########
+#####################################
+
+# distance between every pair of member states in every year, over the six dimensions and their
+# sub-domains, each measure standardized across countries within the year so no scale dominates,
+# the distance is the root mean squared difference over the measures both countries have
+def similarity_matrix(tidy, measures=SUBINDICATORS, countries=countryname_mapping):
+    codes = list(countries)
+    scores = tidy[tidy['measure'].isin(measures) & tidy['Country'].isin(codes)]
+    years = sorted(int(year) for year in scores['year'].unique())
+
+    # (year, country, measure) cube, missing scores stay NaN
+    cells = pd.MultiIndex.from_product([years, codes, list(measures)], names=['year', 'Country', 'measure'])
+    values = scores.assign(Country=scores['Country'].astype(str), measure=scores['measure'].astype(str))
+    values = values.set_index(['year', 'Country', 'measure'])['value'].astype('float64').reindex(cells)
+    cube = values.to_numpy().reshape(len(years), len(codes), len(measures))
+
+    present = ~np.isnan(cube)
+    count = present.sum(axis=1, keepdims=True)
+    mean = np.where(present, cube, 0).sum(axis=1, keepdims=True) / np.maximum(count, 1)
+    spread = np.sqrt(np.where(present, (cube - mean) ** 2, 0).sum(axis=1, keepdims=True) / np.maximum(count, 1))
+    z = np.where(present, (cube - mean) / np.where(spread > 0, spread, 1), 0)
+
+    # all pairs at once, (year, country, country, measure)
+    shared = present[:, :, None, :] & present[:, None, :, :]
+    squared = np.where(shared, (z[:, :, None, :] - z[:, None, :, :]) ** 2, 0).sum(axis=3)
+    n = shared.sum(axis=3)
+    distances = np.full(squared.shape, np.nan)
+    np.sqrt(squared / np.maximum(n, 1), out=distances, where=n > 0)
+    return {'years': years, 'countries': codes, 'index': {c: i for i, c in enumerate(codes)}, 'distances': distances}
+
+
+# the n member states closest to a country in a year (the latest by default), nearest first
+def nearest_countries(similarity, country, year=None, n=3):
+    if country not in similarity['index']:
+        return pd.DataFrame(columns=['Country', 'CountryName', 'distance'])
+    year = similarity['years'][-1] if year is None else year
+    row = similarity['distances'][similarity['years'].index(year), similarity['index'][country]]
+    order = [i for i in np.argsort(row, kind='stable') if i != similarity['index'][country] and not np.isnan(row[i])][:n]
+    codes = [similarity['countries'][i] for i in order]
+    return pd.DataFrame({
+        'Country': codes,
+        'CountryName': [countryname_mapping[c] for c in codes],
+        'distance': row[order].round(SCORE_DECIMALS)
+    })
+
+
+#####################################
+##########   Trends    ##############
+#####################################
+
+# score the trends are projected to, the level the leading member states have already passed
+TREND_TARGET = 80
+
+# years past the latest edition a line is projected, a flatter line is only said to get there later
+TREND_HORIZON = 30
+
+# measures with a trend, the index itself and its six dimensions
+TREND_MEASURES = ['Gender Equality Index'] + DIMENSIONS
+
+
+# straight line through every (measure, country) series, all fitted at once by least squares over the
+# (measure, country, year) cube, years without a score are left out of their series' fit,
+# target_year is the edition year the line reaches the target, NaN when it does not within the horizon,
+# and target_label says the same for a tooltip, including series already at the target, lines that
+# get there only after the horizon and lines that are not rising
+def trend_table(tidy, measures=TREND_MEASURES, target=TREND_TARGET, horizon=TREND_HORIZON):
+    scores = tidy[tidy['measure'].isin(measures)]
+    years = np.array(sorted(int(year) for year in scores['year'].unique()), dtype='float64')
+    codes = sorted(scores['Country'].astype(str).unique())
+
+    cells = pd.MultiIndex.from_product([list(measures), codes, years.astype(int)], names=['measure', 'Country', 'year'])
+    values = scores.assign(Country=scores['Country'].astype(str), measure=scores['measure'].astype(str))
+    values = values.set_index(['measure', 'Country', 'year'])['value'].astype('float64').reindex(cells)
+    y = values.to_numpy().reshape(len(measures), len(codes), len(years))
+
+    # centered sums, the slope of every series is sum(dx * dy) / sum(dx * dx)
+    present = ~np.isnan(y)
+    n = present.sum(axis=2)
+    x_mean = np.where(present, years, 0).sum(axis=2) / np.maximum(n, 1)
+    y_mean = np.where(present, y, 0).sum(axis=2) / np.maximum(n, 1)
+    dx = np.where(present, years - x_mean[..., None], 0)
+    dy = np.where(present, y - y_mean[..., None], 0)
+    sxx = (dx * dx).sum(axis=2)
+    fitted = (n >= 2) & (sxx > 0)
+    slope = np.where(fitted, (dx * dy).sum(axis=2) / np.where(fitted, sxx, 1), np.nan)
+    intercept = y_mean - slope * x_mean
+
+    # latest edition with a score, the projection starts from the line's value there
+    last = np.where(present, np.arange(len(years)), -1).max(axis=2)
+    last_year = np.where(last >= 0, years[np.maximum(last, 0)], np.nan)
+    latest = np.take_along_axis(y, np.maximum(last, 0)[..., None], axis=2)[..., 0]
+    latest = np.where(last >= 0, latest, np.nan)
+    start = intercept + slope * last_year
+    with np.errstate(divide='ignore', invalid='ignore'):
+        years_to_target = np.where(latest >= target, 0, np.where(slope > 0, np.maximum((target - start) / slope, 0), np.nan))
+    beyond = years_to_target > horizon
+    years_to_target = np.where(beyond, np.nan, years_to_target)
+    target_year = np.ceil(last_year + years_to_target)
+
+    # series without a line (fewer than two scores) get no label at all
+    label = np.select(
+        [latest >= target, ~np.isnan(target_year), beyond, fitted],
+        ['already %d or above' % target,
+         np.char.mod('in %d', np.nan_to_num(target_year).astype(int)),
+         np.char.mod('after %d', np.nan_to_num(last_year + horizon).astype(int)),
+         'not on track'],
+        None
+    )
+
+    return pd.DataFrame({
+        'measure': np.repeat(list(measures), len(codes)),
+        'Country': np.tile(codes, len(measures)),
+        'slope': slope.ravel(),
+        'intercept': intercept.ravel(),
+        'last_year': last_year.ravel(),
+        'latest': latest.ravel(),
+        'years_to_target': years_to_target.ravel(),
+        'target_year': target_year.ravel(),
+        'target_label': label.ravel()
+    })
+
+
+# a frame with the trend of one measure next to its scores, the line's value at each row's year as
+# <name> and when it reaches the target as <name>_target, e.g. 'in 2031'
+def with_trend(df, trends, measure, year='year', name='trend'):
+    fit = trends[trends['measure'] == measure].set_index('Country')
+    country = df['Country'].astype(str)
+    line = country.map(fit['intercept']) + country.map(fit['slope']) * df[year].astype(int)
+    return df.assign(**{name: chart_scores(line), name + '_target': country.map(fit['target_label'])})
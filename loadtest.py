@@ -0,0 +1,314 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+from dashboard import APP_PATH, DIMENSION_LABEL, COUNTRY_LABEL, regressions
+
+#####################################
+#########   Load Test    ############
+#####################################
+
+# Starts app.py with `streamlit run` on a local port and drives it through the same websocket the browser
+# uses, with N sessions at once. Every session opens the page (Part 1) and then keeps picking Part 2
+# dimensions and Part 3 countries in its selectboxes, each pick is one rerun timed from the request to
+# the end of the script. For every concurrency level it reports rerun latency percentiles, throughput,
+# failed reruns and the resident memory of the server, nothing leaves the machine.
+#
+#   python loadtest.py                                   # 1, 5, 10 and 20 sessions, writes loadtest_results.json
+#   python loadtest.py --sessions 1 50 100 --reruns 30
+#   python loadtest.py --client --baseline old.json      # exit 1 when a level regressed
+
+# allowed growth over the baseline before a metric counts as a regression
+THRESHOLDS = {
+    'p50_seconds': 0.25,
+    'p99_seconds': 0.50,
+    'peak_rss_bytes': 0.20,
+    'errors': 0.0,
+}
+
+# what a session does after opening the page, weighted like a visitor clicking through the dashboard
+ACTIONS = [('dimension', 3), ('country', 5), ('reload', 1)]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(port, app_path=APP_PATH):
+    command = [
+        sys.executable, '-m', 'streamlit', 'run', app_path,
+        '--server.headless=true',
+        '--server.port=%d' % port,
+        '--server.address=127.0.0.1',
+        '--server.fileWatcherType=none',
+        '--browser.gatherUsageStats=false',
+    ]
+    return subprocess.Popen(command, cwd=os.path.dirname(app_path),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+
+
+def wait_until_healthy(server, port, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError('streamlit exited with code %d' % server.returncode)
+        try:
+            with urllib.request.urlopen('http://127.0.0.1:%d/_stcore/health' % port, timeout=1) as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError('streamlit did not come up on port %d' % port)
+
+
+# resident memory of the server process, only where /proc exists
+def rss_bytes(pid):
+    try:
+        with open('/proc/%d/status' % pid) as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+#####################################
+##########   Sessions    ############
+#####################################
+
+# one browser tab: a websocket session that reruns the script with the widget values it picked
+class Session:
+    def __init__(self, url, query_string, seed):
+        self.url = url
+        self.query_string = query_string
+        self.random = random.Random(seed)
+        self.widgets = {}   # label -> (widget id, options, fragment id)
+        self.values = {}    # widget id -> picked option
+        self.fragment_id = ''
+        self.socket = None
+
+    async def connect(self):
+        import websockets
+
+        self.socket = await websockets.connect(self.url, subprotocols=['streamlit'], max_size=None)
+
+    async def close(self):
+        if self.socket is not None:
+            await self.socket.close()
+
+    # send a rerun with the current widget values and wait for the script to finish, like the browser
+    # only the fragment of the widget that changed reruns, returns the seconds it took and whether
+    # the run ended without an exception
+    async def rerun(self):
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        message = BackMsg()
+        message.rerun_script.query_string = self.query_string
+        message.rerun_script.fragment_id = self.fragment_id
+        for widget_id, value in self.values.items():
+            state = message.rerun_script.widget_states.widgets.add()
+            state.id = widget_id
+            state.string_value = value
+
+        ok = True
+        start = time.perf_counter()
+        await self.socket.send(message.SerializeToString())
+        while True:
+            reply = ForwardMsg()
+            reply.ParseFromString(await self.socket.recv())
+            kind = reply.WhichOneof('type')
+            if kind == 'delta' and reply.delta.WhichOneof('type') == 'new_element':
+                element = reply.delta.new_element
+                if element.WhichOneof('type') == 'exception':
+                    ok = False
+                elif element.WhichOneof('type') == 'selectbox':
+                    self.widgets[element.selectbox.label] = (
+                        element.selectbox.id, list(element.selectbox.options), reply.delta.fragment_id)
+            elif kind == 'script_finished':
+                # anything but a finished run or fragment run, e.g. a compile error or a rerun cut short
+                ok = ok and reply.script_finished in (ForwardMsg.FINISHED_SUCCESSFULLY,
+                                                      ForwardMsg.FINISHED_FRAGMENT_RUN_SUCCESSFULLY)
+                return time.perf_counter() - start, ok
+
+    def pick(self, label):
+        if label not in self.widgets:
+            self.fragment_id = ''
+            return False
+        widget_id, options, fragment_id = self.widgets[label]
+        self.values[widget_id] = self.random.choice(options)
+        self.fragment_id = fragment_id
+        return True
+
+    # the next rerun: a new dimension, a new country or a plain reload of the page
+    def next_action(self):
+        actions, weights = zip(*ACTIONS)
+        action = self.random.choices(actions, weights)[0]
+        if action == 'dimension':
+            self.pick(DIMENSION_LABEL)
+        elif action == 'country':
+            self.pick(COUNTRY_LABEL)
+        else:
+            self.fragment_id = ''
+        return action
+
+
+async def run_session(url, query_string, seed, reruns, latencies, failures):
+    session = Session(url, query_string, seed)
+    try:
+        await session.connect()
+        # opening the page renders Part 1 and the default Part 2 and Part 3 views
+        for i in range(reruns):
+            action = 'open' if i == 0 else session.next_action()
+            seconds, ok = await session.rerun()
+            latencies.append((action, seconds))
+            if not ok:
+                failures.append(action)
+    except Exception as e:
+        failures.append('%s: %s' % (type(e).__name__, e))
+    finally:
+        await session.close()
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+# N sessions at once, memory of the server sampled while they run
+async def run_level(url, query_string, pid, sessions, reruns, seed):
+    latencies, failures, samples = [], [], []
+    done = asyncio.Event()
+
+    async def sample():
+        while not done.is_set():
+            rss = rss_bytes(pid)
+            if rss is not None:
+                samples.append(rss)
+            await asyncio.sleep(0.1)
+
+    sampler = asyncio.create_task(sample())
+    start = time.perf_counter()
+    await asyncio.gather(*[run_session(url, query_string, seed * 1000 + i, reruns, latencies, failures)
+                           for i in range(sessions)])
+    wall = time.perf_counter() - start
+    done.set()
+    await sampler
+
+    seconds = [s for _, s in latencies]
+    by_action = {}
+    for action, s in latencies:
+        by_action.setdefault(action, []).append(s)
+    return {
+        'sessions': sessions,
+        'reruns': len(seconds),
+        'errors': len(failures),
+        'wall_seconds': wall,
+        'throughput': len(seconds) / wall if wall else 0.0,
+        'p50_seconds': percentile(seconds, 50),
+        'p90_seconds': percentile(seconds, 90),
+        'p99_seconds': percentile(seconds, 99),
+        'max_seconds': max(seconds) if seconds else None,
+        'mean_seconds': statistics.mean(seconds) if seconds else None,
+        'p50_by_action': {action: percentile(values, 50) for action, values in sorted(by_action.items())},
+        'rss_bytes': rss_bytes(pid),
+        'peak_rss_bytes': max(samples) if samples else None,
+        'failures': failures[:10],
+    }
+
+
+def run_loadtest(levels=(1, 5, 10, 20), reruns=20, client=False, seed=0, port=None):
+    port = port or free_port()
+    server = start_server(port)
+    try:
+        wait_until_healthy(server, port)
+        url = 'ws://127.0.0.1:%d/_stcore/stream' % port
+        query_string = 'client=1' if client else ''
+
+        async def run_all():
+            # one session first so the workbook load and the first chart compiles are not counted
+            await run_session(url, query_string, seed, 1, [], [])
+            idle = rss_bytes(server.pid)
+            results = []
+            for sessions in levels:
+                results.append(await run_level(url, query_string, server.pid, sessions, reruns, seed))
+            return idle, results
+
+        return asyncio.run(run_all())
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+def environment(args, idle_rss):
+    import streamlit
+
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'cpus': os.cpu_count(),
+        'streamlit': streamlit.__version__,
+        'reruns': args.reruns,
+        'client': args.client,
+        'seed': args.seed,
+        'idle_rss_bytes': idle_rss,
+    }
+
+
+def level_name(result):
+    return '%d sessions' % result['sessions']
+
+
+def megabytes(value):
+    return '%7.1f' % (value / 1e6) if value is not None else '    n/a'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test app.py with concurrent websocket sessions.')
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1, 5, 10, 20], help='concurrency levels, run in order')
+    parser.add_argument('--reruns', type=int, default=20, help='reruns per session, the first opens the page')
+    parser.add_argument('--client', action='store_true', help='load test the client side switching mode')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--port', type=int, help='port for the server, defaults to a free one')
+    parser.add_argument('--output', default='loadtest_results.json')
+    parser.add_argument('--baseline', help='previous results to compare against')
+    args = parser.parse_args(argv)
+
+    idle_rss, results = run_loadtest(args.sessions, args.reruns, args.client, args.seed, args.port)
+    with open(args.output, 'w') as f:
+        json.dump({'environment': environment(args, idle_rss), 'results': results}, f, indent=2)
+
+    print('server idle after warm-up: %s MB' % megabytes(idle_rss).strip())
+    for r in results:
+        print('%4d sessions  %5d reruns  %3d errors  p50 %6.3fs  p90 %6.3fs  p99 %6.3fs  %6.1f reruns/s  rss %s MB  peak %s MB' % (
+            r['sessions'], r['reruns'], r['errors'], r['p50_seconds'] or 0, r['p90_seconds'] or 0,
+            r['p99_seconds'] or 0, r['throughput'], megabytes(r['rss_bytes']), megabytes(r['peak_rss_bytes'])))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), THRESHOLDS, level_name)
+        for line in found:
+            print('REGRESSION ' + line)
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
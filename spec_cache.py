@@ -0,0 +1,326 @@
+import hashlib
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+
+import altair as alt
+
+from timing import stage
+
+#####################################
+#######   Vega-Lite Specs   #########
+#####################################
+
+# compiled chart specs are kept next to the parsed workbook cache
+SPEC_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.index_cache', 'specs')
+
+# specs held in memory, enough for Part 1, every dimension and every country
+MEMORY_ENTRIES = 64
+
+_specs = OrderedDict()
+_lock = threading.Lock()
+_compile_lock = threading.Lock()
+
+# 'section/key/format' -> [bytes as compiled by Altair, bytes after dataset projection and dedup],
+# kept next to the specs so a view read from disk still reports both
+SIZES_PATH = os.path.join(SPEC_CACHE_DIR, 'sizes.json')
+
+_sizes = None
+
+logger = logging.getLogger(__name__)
+
+
+# modules whose code shapes the emitted specs and their data, besides the script that draws the charts
+SPEC_SOURCES = [
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+    for name in ('index_data.py', 'spec_cache.py', 'eu_map.py')
+]
+
+# source digests memoized on (mtime, size), a rerun does not read the modules again
+_source_digests = {}
+
+
+def source_digest(path):
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    if key not in _source_digests:
+        with open(path, 'rb') as f:
+            _source_digests[key] = hashlib.sha256(f.read()).digest()
+    return _source_digests[key]
+
+
+# version of the specs, changes with the workbook, the chart code, the data preparation or the Altair release
+def spec_version(data_version, *sources):
+    digest = hashlib.sha256(data_version.encode())
+    digest.update(alt.__version__.encode())
+    for path in list(sources) + SPEC_SOURCES:
+        digest.update(source_digest(path))
+    return digest.hexdigest()[:16]
+
+
+def spec_path(section, key, version, format='vega-lite'):
+    if format == 'vega':
+        section = section + '-vega'
+    return os.path.join(SPEC_CACHE_DIR, '%s_%s_%s.json' % (section, key, version))
+
+
+# compiled spec of a view, build() only runs when neither memory nor disk has it,
+# format='vega' evaluates the data transforms on the server (see server_transforms_available),
+# requested=False for builds no visitor asked for, they are left out of the request counts
+def get_spec(section, key, version, build, format='vega-lite', requested=True):
+    if requested:
+        count_request(section, key)
+    with stage('spec', section=section, key=key, format=format) as record:
+        cache_key = (section, key, version, format)
+        with _lock:
+            if cache_key in _specs:
+                _specs.move_to_end(cache_key)
+                record['source'] = 'memory'
+                record['bytes'] = spec_sizes().get('%s/%s/%s' % (section, key, format))
+                return _specs[cache_key]
+
+        path = spec_path(section, key, version, format)
+        spec = read_spec(path)
+        record['source'] = 'disk'
+        if spec is None:
+            record['source'] = 'compiled'
+            with stage('build', section=section, key=key):
+                chart = build()
+            with stage('serialize', section=section, key=key):
+                spec = compile_spec(chart, format)
+                before = spec_bytes(spec)
+                spec = dedupe_datasets(spec)
+            logger.info('spec %s/%s: %d -> %d bytes', section, key, before, spec_bytes(spec))
+            write_spec(path, spec)
+            save_size(section, key, format, before, spec_bytes(spec))
+        record['bytes'] = spec_sizes().get('%s/%s/%s' % (section, key, format))
+
+        with _lock:
+            _specs[cache_key] = spec
+            while len(_specs) > MEMORY_ENTRIES:
+                _specs.popitem(last=False)
+        return spec
+
+
+# drop the specs held in memory, the disk cache stays, benchmark.py starts its memory pass from here
+def clear_memory():
+    with _lock:
+        _specs.clear()
+
+
+# same spec st.altair_chart would send, Altair's default theme sizes are left out for Streamlit
+def compile_spec(chart, format='vega-lite'):
+    # the active theme and data transformer are global to the process
+    with _compile_lock:
+        with alt.theme.enable('none'):
+            if format == 'vega':
+                # VegaFusion runs every transform that does not depend on a selection and inlines
+                # only the rows the marks still need, the rest stays in the browser
+                with alt.data_transformers.enable('vegafusion'):
+                    return chart.to_dict(format='vega')
+            return chart.to_dict()
+
+
+# server side transforms need the optional vegafusion package, and vl-convert-python, which compiles
+# the Vega specs and ships the Vega runtime the page embeds them with
+def server_transforms_available():
+    try:
+        import vegafusion  # noqa: F401
+        import vl_convert  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def spec_bytes(spec):
+    return len(json.dumps(spec, separators=(',', ':')))
+
+
+def spec_sizes():
+    global _sizes
+    if _sizes is None:
+        try:
+            with open(SIZES_PATH) as f:
+                _sizes = json.load(f)
+        except (OSError, ValueError):
+            _sizes = {}
+    return _sizes
+
+
+# compiles are rare, every one is written through
+def save_size(section, key, format, compiled, sent):
+    with _lock:
+        sizes = spec_sizes()
+        sizes['%s/%s/%s' % (section, key, format)] = [compiled, sent]
+        sizes = dict(sizes)
+    try:
+        os.makedirs(SPEC_CACHE_DIR, exist_ok=True)
+        tmp = '%s.%d.%d.tmp' % (SIZES_PATH, os.getpid(), threading.get_ident())
+        with open(tmp, 'w') as f:
+            json.dump(sizes, f)
+        os.replace(tmp, SIZES_PATH)
+    except OSError:
+        pass
+
+
+# datum['col'] or datum["col"] (escaped in the JSON body), any other datum[...] is a computed key
+DATUM_KEY = re.compile(r'''datum\[(?:'([^'\\]*)'|\\"([^"\\]*)\\")\]''')
+
+
+# keep only the columns the spec refers to, then emit every distinct dataset once under a content name,
+# a spec that reads a column through a computed key keeps all of them
+def dedupe_datasets(spec):
+    datasets = spec.get('datasets')
+    if not datasets:
+        return spec
+
+    body = json.dumps({k: v for k, v in spec.items() if k != 'datasets'})
+    keys = DATUM_KEY.findall(body)
+    keep_all = body.count('datum[') > len(keys)
+    named = {single or double for single, double in keys}
+
+    def used(column):
+        return keep_all or column in named or ('"%s"' % column) in body or ('datum.%s' % column) in body
+
+    renamed, deduped = {}, {}
+    for name, rows in datasets.items():
+        if isinstance(rows, list) and rows and isinstance(rows[0], dict):
+            columns = [c for c in rows[0] if used(c)]
+            rows = [{c: row.get(c) for c in columns} for row in rows]
+        digest = hashlib.md5(json.dumps(rows, sort_keys=True).encode()).hexdigest()
+        renamed[name] = 'data-' + digest
+        deduped.setdefault('data-' + digest, rows)
+
+    spec = rename_data(spec, renamed)
+    spec['datasets'] = deduped
+    return spec
+
+
+# point every {"data": {"name": ...}} reference at the deduplicated dataset
+def rename_data(node, renamed):
+    if isinstance(node, list):
+        return [rename_data(item, renamed) for item in node]
+    if not isinstance(node, dict):
+        return node
+    node = {k: (rename_data(v, renamed) if k != 'datasets' else v) for k, v in node.items()}
+    data = node.get('data')
+    if isinstance(data, dict) and data.get('name') in renamed:
+        node['data'] = dict(data, name=renamed[data['name']])
+    return node
+
+
+def read_spec(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# write atomically and drop the same view's specs of older versions
+def write_spec(path, spec):
+    try:
+        os.makedirs(SPEC_CACHE_DIR, exist_ok=True)
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(spec, f, separators=(',', ':'))
+        os.replace(tmp, path)
+
+        prefix = os.path.basename(path).rsplit('_', 1)[0] + '_'
+        for old in os.listdir(SPEC_CACHE_DIR):
+            if old.startswith(prefix) and old.endswith('.json') and old != os.path.basename(path):
+                os.remove(os.path.join(SPEC_CACHE_DIR, old))
+    except OSError:
+        # nothing to persist on a read-only disk, the memory copy is still used
+        pass
+
+
+#####################################
+#########   Warm-up    ##############
+#####################################
+
+# how often each view was requested, kept across restarts so a warm-up can start with the popular ones
+REQUESTS_PATH = os.path.join(SPEC_CACHE_DIR, 'requests.json')
+
+# requests between two writes of the counts
+REQUESTS_FLUSH_EVERY = 20
+
+# threads building specs in the background, compiles are serialized anyway, a second thread keeps
+# the data preparation of the next view going meanwhile
+WARM_UP_THREADS = 2
+
+_requests = None
+_unsaved_requests = 0
+
+
+def request_counts():
+    global _requests
+    if _requests is None:
+        try:
+            with open(REQUESTS_PATH) as f:
+                _requests = Counter(json.load(f))
+        except (OSError, ValueError):
+            _requests = Counter()
+    return _requests
+
+
+def count_request(section, key):
+    global _unsaved_requests
+    with _lock:
+        counts = request_counts()
+        counts['%s/%s' % (section, key)] += 1
+        _unsaved_requests += 1
+        if _unsaved_requests < REQUESTS_FLUSH_EVERY:
+            return
+        _unsaved_requests = 0
+        counts = dict(counts)
+    try:
+        os.makedirs(SPEC_CACHE_DIR, exist_ok=True)
+        tmp = '%s.%d.%d.tmp' % (REQUESTS_PATH, os.getpid(), threading.get_ident())
+        with open(tmp, 'w') as f:
+            json.dump(counts, f)
+        os.replace(tmp, REQUESTS_PATH)
+    except OSError:
+        pass
+
+
+# views ordered for a warm-up, the given defaults first, then the most requested, ties in the given order
+def warm_up_order(views, first=()):
+    counts = request_counts()
+    rank = {(section, key): i for i, (section, key) in enumerate(first)}
+    return sorted(views, key=lambda view: (rank.get(view[:2], len(rank)), -counts['%s/%s' % view[:2]]))
+
+
+# build specs of views in background threads, views are (section, key, version, build, format)
+# taken in list order, a view whose spec is already cached costs a lookup
+def warm_up(views, threads=WARM_UP_THREADS):
+    pending = queue.Queue()
+    for view in views:
+        pending.put(view)
+    start = time.perf_counter()
+    remaining = [threads]
+
+    def work():
+        while True:
+            try:
+                section, key, version, build, format = pending.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                get_spec(section, key, version, build, format, requested=False)
+            except Exception:
+                logger.exception('warm-up of %s/%s failed', section, key)
+        with _lock:
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                logger.info('warm-up: %d views in %.1f s', len(views), time.perf_counter() - start)
+
+    workers = [threading.Thread(target=work, name='spec-warm-up-%d' % i, daemon=True) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    return workers
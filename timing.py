@@ -0,0 +1,122 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+#####################################
+#########   Rerun Timing   ##########
+#####################################
+
+# wall time of the logical stages of one script run and counters of expensive work,
+# one record per thread since Streamlit runs every rerun of a session in its own thread
+_run = threading.local()
+
+logger = logging.getLogger(__name__)
+
+# the dashboard's own loggers, Streamlit only sets up handlers for streamlit.* so without one of their own
+# their INFO lines (the rerun records above all) never reach the server log
+DASHBOARD_LOGGERS = ['timing', 'index_data', 'spec_cache']
+
+
+# send the dashboard loggers to stderr next to Streamlit's output, at DASHBOARD_LOG_LEVEL (INFO by default,
+# WARNING keeps only problems, OFF silences them), safe to call on every rerun
+def configure_logging():
+    level = os.environ.get('DASHBOARD_LOG_LEVEL', 'INFO').upper()
+    for name in DASHBOARD_LOGGERS:
+        target = logging.getLogger(name)
+        if any(getattr(handler, 'dashboard', False) for handler in target.handlers):
+            continue
+        handler = logging.StreamHandler(sys.stderr)
+        handler.dashboard = True
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+        target.addHandler(handler)
+        target.setLevel(logging.CRITICAL + 1 if level == 'OFF' else level)
+        # the root logger may have handlers of its own, e.g. under a test runner, log each line once
+        target.propagate = False
+
+
+def start_run():
+    _run.start = time.perf_counter()
+    _run.stages = []
+    _run.depth = 0
+    _run.counters = {'sheets_parsed': 0}
+
+
+def current_run():
+    if not hasattr(_run, 'stages'):
+        start_run()
+    return _run
+
+
+# time a stage, nested stages keep their depth, extra fields (section, key, cache source, ...) go into the record
+@contextmanager
+def stage(name, **fields):
+    run = current_run()
+    record = dict(stage=name, depth=run.depth, **fields)
+    run.stages.append(record)
+    run.depth += 1
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['seconds'] = time.perf_counter() - start
+        run.depth -= 1
+
+
+def count(counter, n=1):
+    run = current_run()
+    run.counters[counter] = run.counters.get(counter, 0) + n
+
+
+# summary of the run, logged as one JSON line so it can be grepped and parsed
+def finish_run(**fields):
+    run = current_run()
+    summary = dict(
+        event='rerun',
+        seconds=time.perf_counter() - run.start,
+        counters=dict(run.counters),
+        stages=list(run.stages),
+        **fields
+    )
+    logger.info(json.dumps(summary, default=str))
+    return summary
+
+
+# a section that can rerun on its own (st.fragment), when only the section reruns its stages are
+# logged as a run of their own, inside a full rerun they belong to the page's run
+@contextmanager
+def fragment_run(section):
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+    ctx = get_script_run_ctx()
+    if ctx is None or not ctx.fragment_ids_this_run:
+        yield
+        return
+    start_run()
+    try:
+        yield
+    finally:
+        finish_run(fragment=section)
+
+
+# the stages as rows for the debug panel, indented by depth
+def stage_rows(summary):
+    return [{
+        'stage': '  ' * record['depth'] + record['stage'],
+        'view': '/'.join(str(record[k]) for k in ('section', 'key') if k in record),
+        'source': record.get('source', ''),
+        'ms': round(record.get('seconds', 0) * 1000, 1)
+    } for record in summary['stages']]
+
+
+# chart specs of the run as compiled by Altair and as sent after dataset projection and dedup
+def spec_rows(summary):
+    return [{
+        'view': '%s/%s' % (record['section'], record['key']),
+        'source': record.get('source', ''),
+        'compiled KB': round(record['bytes'][0] / 1024, 1),
+        'sent KB': round(record['bytes'][1] / 1024, 1)
+    } for record in summary['stages'] if record['stage'] == 'spec' and record.get('bytes')]